@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+コマンドラインからDEMを作成する (QGISのGUIなしで実行可能。GDAL/numpy/requestsが必要)
+
+例 (プラグインフォルダの親ディレクトリで実行):
+    python -m png_tile_2_dem --extent 139.70,35.65,139.72,35.67 --source chiriin \
+        --crs EPSG:6677 --output dem.tif
+"""
+
+import sys
+import argparse
+
+from . import png_tile_2_dem_core as core
+from .png_tile_2_dem_sources import TILE_SOURCES
+from .png_tile_2_dem_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_BYTES, DEFAULT_MEMORY_BYTES
+from .png_tile_2_dem_decode import IMAGE_BACKENDS, set_image_backend
+
+
+def parse_extent(text):
+    try:
+        values = [float(v) for v in text.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("minx,miny,maxx,maxy の形式で指定してください")
+    minx, miny, maxx, maxy = values
+    return min(minx, maxx), min(miny, maxy), max(minx, maxx), max(miny, maxy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="png_tile_2_dem", description="標高タイルからDEM (GeoTIFF) を作成します")
+    parser.add_argument("--extent", type=parse_extent, help="範囲 minx,miny,maxx,maxy (--extent-crs の座標)")
+    parser.add_argument("--extent-crs", default="EPSG:4326", help="範囲の座標参照系 (既定: EPSG:4326)")
+    parser.add_argument("--source", default=TILE_SOURCES[0]["key"], help="優先するDEMソースのキー (--list-sources で一覧)")
+    parser.add_argument("--crs", default="EPSG:4326", help="出力の座標参照系 (例: EPSG:6677)")
+    parser.add_argument("--output", help="出力するGeoTIFFのパス")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="タイルキャッシュのフォルダ")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), help="タイルキャッシュの容量 (MB, 0で無効)")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_BYTES // (1024 * 1024),
+                        help="実行中にメモリに保持するデコード済みタイルの上限 (MB)")
+    parser.add_argument("--job-dir", help="中断後に再開するための作業フォルダ")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="デコード・合成を行うプロセス数 (0はスレッドのみ。キャッシュ済みの大きな範囲で有効)")
+    parser.add_argument("--image-backend", choices=IMAGE_BACKENDS, default="gdal",
+                        help="タイル画像の読み込みに使うライブラリ (既定: gdal)")
+    parser.add_argument("--report", help="段階ごとの時間や通信量をまとめたJSONレポートの保存先")
+    parser.add_argument("--layout", choices=core.OUTPUT_LAYOUTS, default="auto",
+                        help="出力の形式 (auto: 大きなDEMだけCOG / cog: オーバービュー付きCOG / gtiff: タイル化GeoTIFF)")
+    parser.add_argument("--compress", type=str.upper, choices=core.OUTPUT_COMPRESSIONS, default="DEFLATE",
+                        help="出力の圧縮方式 (既定: DEFLATE)")
+    parser.add_argument("--max-z-error", type=float, default=0.0, help="LERC系の圧縮で許容する誤差 (m, 既定: 0 = 可逆)")
+    parser.add_argument("--int-cm", action="store_true", help="センチメートル単位のInt32で保存する (スケール0.01付き)")
+    parser.add_argument("--list-sources", action="store_true", help="DEMソースの一覧を表示して終了")
+    parser.add_argument("--quiet", action="store_true", help="進捗を表示しない")
+    args = parser.parse_args(argv)
+
+    if args.list_sources:
+        for s in TILE_SOURCES:
+            print(f"{s['key']}\tz{s['zoom']}\t{s.get('name', '')}")
+        return 0
+    if args.extent is None or not args.output:
+        parser.error("--extent と --output は必須です")
+
+    # QGISの外ではQtのアプリケーションがないため、既定では画像のデコードはGDALで行う
+    try:
+        set_image_backend(args.image_backend)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        lonlat_bounds, out_bounds = core.extent_to_job_bounds(args.extent, args.extent_crs, args.crs)
+        core.run_job(lonlat_bounds, out_bounds, args.source, args.crs, args.output,
+                     feedback=core.ConsoleFeedback(args.quiet), cache_dir=args.cache_dir,
+                     cache_bytes=args.cache_mb * 1024 * 1024, job_dir=args.job_dir,
+                     processes=max(0, args.processes), report_path=args.report,
+                     output_options={"layout": args.layout, "compress": args.compress,
+                                     "max_z_error": max(0.0, args.max_z_error), "int_cm": args.int_cm},
+                     memory_bytes=max(0, args.memory_mb) * 1024 * 1024)
+    except core.PngTile2DemError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    if not args.quiet:
+        print(f"出力: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+標高タイルのデコード速度の比較
+以前のチャンネルごとの実装 (legacy) と、uint32で1回走査する decode_rgba_batch を比べる。
+numpyのみで動く (QGIS/GDALは不要)。
+
+    python benchmarks/bench_decode.py [--tiles 256] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from png_tile_2_dem_decode import decode_rgba_batch, FORMAT_GSI, FORMAT_QMAP, FORMAT_GSJ
+
+
+# ------------------------------------------------------------------------------
+# 以前の実装 (比較用)
+# ------------------------------------------------------------------------------
+
+def legacy_decode_gsi_png(img_arr):
+    r = img_arr[:, :, 0].astype(np.int32)
+    g = img_arr[:, :, 1].astype(np.int32)
+    b = img_arr[:, :, 2].astype(np.int32)
+    x = (r << 16) + (g << 8) + b
+    height = np.empty_like(x, dtype=np.float32)
+    mask_low = x < (1 << 23)
+    height[mask_low] = x[mask_low] * 0.01
+    height[x == (1 << 23)] = np.nan
+    height[x == 0] = np.nan
+    height[img_arr[:, :, 3] == 0] = np.nan
+    mask_high = x > (1 << 23)
+    height[mask_high] = (x[mask_high] - (1 << 24)) * 0.01
+    return height
+
+def legacy_decode_qmap_rgb(img_arr):
+    r = img_arr[:, :, 0].astype(np.float32)
+    g = img_arr[:, :, 1].astype(np.float32)
+    b = img_arr[:, :, 2].astype(np.float32)
+    height = (r * 256 * 256 + g * 256 + b) * 0.01
+    height[(r == 128) & (g == 0) & (b == 0)] = np.nan
+    height[(r == 0) & (g == 0) & (b == 0)] = np.nan
+    height[img_arr[:, :, 3] == 0] = np.nan
+    return height
+
+def legacy_decode_gsj_png(img_arr):
+    r = img_arr[:, :, 0].astype(np.float32)
+    g = img_arr[:, :, 1].astype(np.float32)
+    b = img_arr[:, :, 2].astype(np.float32)
+    height = (r * 256 * 256 + g * 256 + b) * 0.01
+    height[img_arr[:, :, 3] == 0] = np.nan
+    return height
+
+LEGACY = {FORMAT_GSI: legacy_decode_gsi_png, FORMAT_QMAP: legacy_decode_qmap_rgb, FORMAT_GSJ: legacy_decode_gsj_png}
+
+
+def make_tiles(n, seed=0):
+    """地形らしい値と、NoData (黒・(128,0,0)・透明) を含むRGBAタイルを作る"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:256, 0:256]
+    tiles = np.empty((n, 256, 256, 4), dtype=np.uint8)
+    for i in range(n):
+        elev = 500 + 300 * np.sin((xx + i) / 40.0) * np.cos(yy / 55.0) + rng.normal(0, 2, (256, 256))
+        x = np.round(elev * 100).astype(np.int64) & 0xFFFFFF
+        tiles[i, :, :, 0] = x >> 16
+        tiles[i, :, :, 1] = (x >> 8) & 0xFF
+        tiles[i, :, :, 2] = x & 0xFF
+        tiles[i, :, :, 3] = 255
+        tiles[i, :32, :, :3] = (128, 0, 0)
+        tiles[i, :, :16, :3] = 0
+        tiles[i, -16:, :, 3] = 0
+    return tiles
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tiles", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tiles = make_tiles(args.tiles)
+    out = np.empty(tiles.shape[:3], dtype=np.float32)
+    print(f"{args.tiles} tiles x 256x256, best of {args.repeat}")
+    print(f"{'format':6} {'legacy':>10} {'per tile':>10} {'batch':>10} {'speedup':>8}")
+    for fmt, legacy in LEGACY.items():
+        # 結果が以前の実装と一致することを確認する
+        for tile in tiles[:4]:
+            assert np.array_equal(legacy(tile), decode_rgba_batch(tile, fmt), equal_nan=True), fmt
+
+        t_legacy = best_of(lambda: [legacy(t) for t in tiles], args.repeat)
+        t_single = best_of(lambda: [decode_rgba_batch(t, fmt) for t in tiles], args.repeat)
+        t_batch = best_of(lambda: decode_rgba_batch(tiles, fmt, out=out), args.repeat)
+        rate = lambda t: f"{args.tiles / t:8.0f}/s"
+        print(f"{fmt:6} {rate(t_legacy):>10} {rate(t_single):>10} {rate(t_batch):>10} {t_legacy / t_batch:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
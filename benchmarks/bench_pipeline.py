@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+処理全体のベンチマーク (ローカルのモックタイルサーバーを使い、実際のサーバーには接続しない)
+範囲と主ソース (ズーム) を変えた複数のシナリオで、以下を測る。
+- 全体のタイル数/秒 (取得 → デコード → 合成 → Warp)
+- デコード・リサイズ・合成それぞれの処理量 (1スレッド)
+- Warpの時間 / ピークメモリ (RSS)
+- 実行前の見積もり時間と実際の時間
+
+    python benchmarks/bench_pipeline.py [--latency 20] [--p404 0.02] [--p429 0.01] [--json result.json]
+
+GDALとnumpy、requestsが必要 (QGISは不要)。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import shutil
+import importlib
+import importlib.util
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+from mock_tile_server import MockTileServer, tile_sources_for
+
+# (名前, 主ソース, 範囲 (経度・緯度: minx, miny, maxx, maxy), 出力CRS)
+SCENARIOS = [
+    ("small-z17-gsi", "chiriin", (139.700, 35.680, 139.715, 35.690), "EPSG:6677"),
+    ("small-z17-qmap", "qmap", (139.700, 35.680, 139.715, 35.690), "EPSG:6677"),
+    ("small-z19-gsj", "tokyo", (139.700, 35.680, 139.705, 35.684), "EPSG:6677"),
+    # 提供範囲の境界をまたぎ、5mDEM等での補完が起きる範囲
+    ("edge-z17-fallback", "chiriin", (139.780, 35.680, 139.830, 35.700), "EPSG:6677"),
+    ("medium-z17-gsi", "chiriin", (139.650, 35.650, 139.700, 35.690), "EPSG:3857"),
+]
+WARM_TASKS = 256  # キャッシュが温まった状態で合成を測るタスク数 (メモリ上のキャッシュに収まる数)
+
+
+def import_core():
+    """フォルダ名によらず、プラグインを png_tile_2_dem パッケージとして読み込む"""
+    spec = importlib.util.spec_from_file_location(
+        "png_tile_2_dem", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["png_tile_2_dem"] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module("png_tile_2_dem.png_tile_2_dem_core")
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class QuietFeedback:
+    def __init__(self):
+        self.errors = []
+    def pushInfo(self, message): pass
+    def reportError(self, message, fatalError=False): self.errors.append(message)
+    def setProgress(self, progress): pass
+    def isCanceled(self): return False
+
+
+def timed(func, *args, repeat=1):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return (time.perf_counter() - t0) / repeat, result
+
+
+def run_scenario(core, server, name, primary_key, extent, out_crs, workdir):
+    sources = tile_sources_for(server.base_url)
+    source = core.find_source(primary_key, sources)
+    lonlat_bounds, out_bounds = core.extent_to_job_bounds(extent, "EPSG:4326", out_crs)
+    tx0, ty0, tx1, ty1 = core.tile_range_for_lonlat(lonlat_bounds, source["zoom"])
+    n_tiles = (tx1 - tx0 + 1) * (ty1 - ty0 + 1)
+
+    # Warpにかかった時間を測るため、このシナリオの間だけgdal.Warpを包む
+    warp_time = [0.0]
+    original_warp = core.gdal.Warp
+    def timed_warp(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return original_warp(*args, **kwargs)
+        finally:
+            warp_time[0] += time.perf_counter() - t0
+
+    # 見積もりの記録はベンチマーク用のフォルダに残す (シナリオを重ねるごとに自己較正される)
+    history_dir = os.path.join(workdir, "history")
+    plan = importlib.import_module("png_tile_2_dem.png_tile_2_dem_plan")
+    _, _, estimated = plan.estimate_job((tx0, ty0, tx1, ty1), source["zoom"], primary_key, sources,
+                                        cache_dir=history_dir, use_cache=False)
+
+    requests_before = server.counts["requests"]
+    output = os.path.join(workdir, f"{name}.tif")
+    core.gdal.Warp = timed_warp
+    try:
+        # タイルキャッシュは使わず、毎回サーバーから取得する
+        elapsed, _ = timed(lambda: core.run_job(lonlat_bounds, out_bounds, primary_key, out_crs, output,
+                                                feedback=QuietFeedback(), cache_dir=history_dir, cache_bytes=0,
+                                                sources=sources))
+    finally:
+        core.gdal.Warp = original_warp
+    result = {
+        "scenario": name, "primary": primary_key, "zoom": source["zoom"], "tiles": n_tiles,
+        "seconds": elapsed, "tiles_per_s": n_tiles / elapsed, "sec_per_tile": elapsed / n_tiles,
+        "warp_seconds": warp_time[0], "requests": server.counts["requests"] - requests_before,
+        "estimated_seconds": estimated,
+    }
+
+    # 合成 (メモリ上のキャッシュが温まった状態、1スレッド)
+    tasks = [(x, y, source["zoom"], primary_key, sources, -9999.0)
+             for y in range(ty0, ty1 + 1) for x in range(tx0, tx1 + 1)][:WARM_TASKS]
+    t, _ = timed(lambda: [core.process_single_tile_composite(task) for task in tasks])
+    result["composite_tiles_per_s"] = len(tasks) / t
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def micro_benchmarks(core, server, repeat=200):
+    """デコードとリサイズの処理量 (1スレッド)"""
+    import requests
+    results = {}
+    sources = tile_sources_for(server.base_url)
+    for key in ("chiriin", "qmap", "tokyo"):
+        source = core.find_source(key, sources)
+        z = source["zoom"] - (1 if key == "qmap" else 0)
+        x, y = core.lonlat_to_tile(139.70, 35.68, z)
+        content = requests.get(source["url"].format(z=z, x=x, y=y), timeout=10).content
+        t, _ = timed(core.decode_tile_image, content, source, key == "qmap", repeat=repeat)
+        results[f"decode_{key}_per_s"] = 1.0 / t
+
+    rng = np.random.default_rng(0)
+    tile = rng.random((256, 256)).astype(np.float32)
+    t, _ = timed(core.resize_array_bilinear, tile, (64, 64), repeat=repeat)
+    results["resize_down_per_s"] = 1.0 / t
+    t, _ = timed(core.resize_window_bilinear, tile, (1024, 1024), 256, 256, 256, 256, repeat=repeat)
+    results["resize_window_per_s"] = 1.0 / t
+    # NaNを含むタイルのマスク付き縮小 (合成時の高ズームのサブタイル)
+    holed = tile.copy()
+    holed[:64, :96] = np.nan
+    t, _ = timed(core.resize_normalized, holed, (64, 64), repeat=repeat)
+    results["resize_normalized_per_s"] = 1.0 / t
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モックタイルサーバーを使った処理全体のベンチマーク")
+    parser.add_argument("--latency", type=float, default=20.0, help="サーバーの応答遅延 (ミリ秒)")
+    parser.add_argument("--jitter", type=float, default=5.0, help="遅延のばらつき (ミリ秒)")
+    parser.add_argument("--p404", type=float, default=0.0, help="404を返す確率")
+    parser.add_argument("--p429", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--scenario", action="append", help="実行するシナリオ名 (複数指定可。既定は全て)")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    core = import_core()
+    server = MockTileServer(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                            p404=args.p404, p429=args.p429).start()
+    workdir = tempfile.mkdtemp(prefix="pngtile_bench_")
+    report = {"settings": vars(args), "image_backend": None, "scenarios": [], "micro": {}}
+    try:
+        from png_tile_2_dem import png_tile_2_dem_decode
+        report["image_backend"] = png_tile_2_dem_decode.IMAGE_BACKEND
+
+        print(f"{'scenario':20} {'zoom':>4} {'tiles':>6} {'tiles/s':>8} {'s/tile':>7} {'warp s':>7} {'comp/s':>7} {'RSS MB':>7} {'est s':>7} {'real s':>7}")
+        for name, primary_key, extent, out_crs in SCENARIOS:
+            if args.scenario and name not in args.scenario:
+                continue
+            r = run_scenario(core, server, name, primary_key, extent, out_crs, workdir)
+            report["scenarios"].append(r)
+            rss = f"{r['peak_rss_mb']:7.0f}" if r["peak_rss_mb"] is not None else "      -"
+            print(f"{name:20} {r['zoom']:>4} {r['tiles']:>6} {r['tiles_per_s']:8.1f} {r['sec_per_tile']:7.3f} "
+                  f"{r['warp_seconds']:7.2f} {r['composite_tiles_per_s']:7.0f} {rss} "
+                  f"{r['estimated_seconds']:7.1f} {r['seconds']:7.1f}", flush=True)
+
+        report["micro"] = micro_benchmarks(core, server)
+        for k, v in report["micro"].items():
+            print(f"{k:24} {v:10.0f}/s")
+        report["server"] = dict(server.counts)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
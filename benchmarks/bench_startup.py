@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+プラグイン読み込み時間のベンチマーク
+QGISの起動時に読み込まれるモジュール (プロバイダー・アルゴリズムの定義・ソース一覧・見積もり) を
+新しいPythonプロセスで読み込み、その時間と、numpy・GDAL・requests が読み込まれていないことを確かめる。
+比較のため、処理本体 (png_tile_2_dem_core) の読み込み時間も測る。
+
+    python benchmarks/bench_startup.py [--repeat 5] [--max-ms 50] [--json result.json]
+
+重いモジュールが読み込まれた場合や --max-ms を超えた場合は終了コード1を返す (退行の検出用)。
+QGISがない環境では、プロバイダーとアルゴリズムの代わりに、それらが読み込むモジュールだけを測る。
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# 起動時に読み込まれてはいけないモジュール
+HEAVY_MODULES = ["numpy", "osgeo", "requests", "png_tile_2_dem.png_tile_2_dem_core"]
+
+# 新しいプロセスで実行するコード (フォルダ名によらず png_tile_2_dem パッケージとして読み込む)
+CHILD = r"""
+import sys, json, time, importlib, importlib.util
+root, targets, heavy = sys.argv[1], sys.argv[2].split(","), sys.argv[3].split(",")
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    "png_tile_2_dem", root + "/__init__.py", submodule_search_locations=[root])
+package = importlib.util.module_from_spec(spec)
+sys.modules["png_tile_2_dem"] = package
+spec.loader.exec_module(package)
+for name in targets:
+    importlib.import_module("png_tile_2_dem." + name)
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in heavy if m in sys.modules]}))
+"""
+
+
+def has_qgis():
+    try:
+        import qgis.core  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def measure(targets, repeat):
+    """新しいプロセスで targets を読み込む時間 (中央値) と、読み込まれた重いモジュール"""
+    times, loaded = [], set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", CHILD, ROOT, ",".join(targets), ",".join(HEAVY_MODULES)],
+                             check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return statistics.median(times), sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プラグイン読み込み時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の回数 (中央値を使う)")
+    parser.add_argument("--max-ms", type=float, default=None, help="起動時の読み込み時間の上限 (ミリ秒)")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    if has_qgis():
+        startup = ["png_tile_2_dem_provider"]
+    else:
+        startup = ["png_tile_2_dem_sources", "png_tile_2_dem_plan", "png_tile_2_dem_zones"]
+
+    report = {"startup_modules": startup}
+    failed = False
+    seconds, loaded = measure(startup, args.repeat)
+    report["startup"] = {"seconds": seconds, "heavy_loaded": loaded}
+    print(f"{'startup':12} {seconds * 1000:8.1f} ms  ({', '.join(startup)})")
+    if loaded:
+        print(f"起動時に重いモジュールが読み込まれています: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms is not None and seconds * 1000 > args.max_ms:
+        print(f"起動時の読み込みが上限 ({args.max_ms} ms) を超えています")
+        failed = True
+
+    try:
+        seconds, _ = measure(["png_tile_2_dem_core"], args.repeat)
+        report["core"] = {"seconds": seconds}
+        print(f"{'core':12} {seconds * 1000:8.1f} ms  (実行時に読み込む処理本体)")
+    except subprocess.CalledProcessError as e:
+        # GDALなどがない環境では処理本体は測れない
+        print(f"{'core':12}        -     (読み込めません: {e.stderr.strip().splitlines()[-1]})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
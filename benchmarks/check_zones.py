@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+平面直角座標系の系番号表 (png_tile_2_dem_zones) の確認
+都道府県庁所在地と、系が分かれる島・県境近くの市町村について、期待する系番号になるかを調べる。
+
+    python benchmarks/check_zones.py
+
+一致しない地点があれば一覧を表示して終了コード1を返す (表を変更したときの退行の検出用)。
+"""
+
+import os
+import sys
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# (地点, 経度, 緯度, 期待する系番号)
+CASES = [
+    # --- 都道府県庁所在地 ---
+    ("札幌", 141.35, 43.06, 12),
+    ("青森", 140.74, 40.82, 10),
+    ("盛岡", 141.15, 39.70, 10),
+    ("仙台", 140.87, 38.27, 10),
+    ("秋田", 140.10, 39.72, 10),
+    ("山形", 140.36, 38.24, 10),
+    ("福島", 140.47, 37.76, 9),
+    ("水戸", 140.47, 36.34, 9),
+    ("宇都宮", 139.88, 36.56, 9),
+    ("前橋", 139.06, 36.39, 9),
+    ("さいたま", 139.65, 35.86, 9),
+    ("千葉", 140.12, 35.60, 9),
+    ("東京 (新宿)", 139.69, 35.69, 9),
+    ("横浜", 139.64, 35.45, 9),
+    ("新潟", 139.02, 37.90, 8),
+    ("富山", 137.21, 36.70, 7),
+    ("金沢", 136.63, 36.56, 7),
+    ("福井", 136.22, 36.06, 6),
+    ("甲府", 138.57, 35.66, 8),
+    ("長野", 138.18, 36.65, 8),
+    ("岐阜", 136.76, 35.42, 7),
+    ("静岡", 138.38, 34.98, 8),
+    ("名古屋", 136.91, 35.18, 7),
+    ("津", 136.51, 34.73, 6),
+    ("大津", 135.87, 35.00, 6),
+    ("京都", 135.77, 35.01, 6),
+    ("大阪", 135.50, 34.69, 6),
+    ("神戸", 135.18, 34.69, 5),
+    ("奈良", 135.83, 34.69, 6),
+    ("和歌山", 135.17, 34.23, 6),
+    ("鳥取", 134.24, 35.50, 5),
+    ("松江", 133.05, 35.47, 3),
+    ("岡山", 133.93, 34.66, 5),
+    ("広島", 132.46, 34.40, 3),
+    ("山口", 131.47, 34.19, 3),
+    ("徳島", 134.56, 34.07, 4),
+    ("高松", 134.04, 34.34, 4),
+    ("松山", 132.77, 33.84, 4),
+    ("高知", 133.53, 33.56, 4),
+    ("福岡", 130.40, 33.59, 2),
+    ("佐賀", 130.30, 33.25, 2),
+    ("長崎", 129.87, 32.75, 1),
+    ("熊本", 130.74, 32.79, 2),
+    ("大分", 131.61, 33.24, 2),
+    ("宮崎", 131.42, 31.91, 2),
+    ("鹿児島", 130.56, 31.60, 2),
+    ("那覇", 127.68, 26.21, 15),
+    # --- 北海道 ---
+    ("函館", 140.73, 41.77, 11),
+    ("小樽", 141.00, 43.19, 11),
+    ("室蘭", 140.97, 42.32, 12),
+    ("旭川", 142.36, 43.77, 12),
+    ("帯広", 143.20, 42.92, 13),
+    ("釧路", 144.38, 42.98, 13),
+    # --- 東京都の島 ---
+    ("八丈島", 139.79, 33.11, 9),
+    ("父島", 142.19, 27.09, 14),
+    ("沖ノ鳥島", 136.08, 20.42, 18),
+    ("南鳥島", 153.98, 24.28, 19),
+    # --- 鹿児島県 (東経130度13分から西の北緯27〜32度は1系) ---
+    ("奄美 (名瀬)", 129.49, 28.38, 1),
+    ("徳之島", 128.95, 27.78, 1),
+    ("与論島", 128.43, 27.04, 1),
+    ("甑島", 129.80, 31.75, 1),
+    ("トカラ列島 (中之島)", 129.85, 29.85, 1),
+    ("口永良部島", 130.20, 30.46, 1),
+    ("屋久島", 130.53, 30.35, 2),
+    ("種子島", 131.00, 30.60, 2),
+    # --- 沖縄県 ---
+    ("石垣島", 124.16, 24.34, 16),
+    ("南大東島", 131.24, 25.83, 17),
+    # --- 長崎県の島 ---
+    ("対馬", 129.29, 34.20, 1),
+    ("五島 (福江)", 128.84, 32.70, 1),
+    # --- 県境に近い市町村 ---
+    ("下関", 130.941, 33.957, 3),
+    ("北九州 (小倉)", 130.88, 33.88, 2),
+    ("北九州 (門司港)", 130.962, 33.945, 2),
+    ("四日市", 136.624, 34.965, 6),
+    ("桑名", 136.684, 35.062, 6),
+    ("弥富", 136.73, 35.11, 7),
+    ("大垣", 136.61, 35.36, 7),
+    ("養老", 136.56, 35.31, 7),
+    ("彦根", 136.26, 35.27, 6),
+    ("いなべ", 136.56, 35.12, 6),
+    ("奥多摩", 139.10, 35.81, 9),
+    ("上野原", 139.11, 35.63, 8),
+    ("小菅", 138.94, 35.76, 8),
+    ("青梅", 139.28, 35.79, 9),
+    ("八王子", 139.32, 35.66, 9),
+    ("只見", 139.31, 37.35, 9),
+    ("魚沼", 138.96, 37.23, 8),
+    ("阿賀", 139.45, 37.68, 8),
+    ("西会津", 139.65, 37.59, 9),
+    ("佐渡", 138.37, 38.02, 8),
+    ("隠岐", 133.32, 36.21, 3),
+    ("玉野", 133.946, 34.487, 5),
+    ("玉野 (渋川)", 133.91, 34.46, 5),
+    ("牛窓", 134.12, 34.61, 5),
+    ("直島", 133.99, 34.455, 4),
+    ("小豆島 (土庄)", 134.19, 34.49, 4),
+    ("小豆島", 134.27, 34.48, 4),
+    ("安来", 133.25, 35.43, 3),
+    ("米子", 133.33, 35.43, 5),
+    ("境港", 133.231, 35.539, 5),
+    ("美保関", 133.319, 35.563, 3),
+    ("あわら", 136.229, 36.211, 6),
+    ("あわら (吉崎)", 136.25, 36.26, 6),
+    ("加賀", 136.31, 36.30, 7),
+    ("湯河原", 139.109, 35.148, 9),
+    ("熱海", 139.07, 35.10, 8),
+    ("箱根", 139.02, 35.23, 9),
+    ("丸森", 140.77, 37.91, 10),
+    ("伊達 (福島県)", 140.51, 37.82, 9),
+    ("国見", 140.55, 37.88, 9),
+    ("新地", 140.92, 37.875, 9),
+    ("白石", 140.62, 38.00, 10),
+    ("米沢", 140.12, 37.92, 10),
+    # --- 北海道の振興局境 ---
+    ("占冠", 142.40, 42.98, 12),
+    ("占冠 (トマム)", 142.63, 43.07, 12),
+    ("新得", 142.83, 43.08, 13),
+    ("清水 (十勝)", 142.88, 43.01, 13),
+    ("日高", 142.39, 42.88, 12),
+    ("苫小牧", 141.60, 42.63, 12),
+    ("えりも", 143.15, 42.02, 12),
+    ("広尾", 143.31, 42.29, 13),
+]
+
+
+def load_zones():
+    """png_tile_2_dem_zones は他のモジュールに依存しないので、ファイルから直接読み込む"""
+    spec = importlib.util.spec_from_file_location("png_tile_2_dem_zones", os.path.join(ROOT, "png_tile_2_dem_zones.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    zones = load_zones()
+    failures = []
+    for name, lon, lat, expected in CASES:
+        zone = zones.plane_rectangular_zone(lon, lat)
+        if zone != expected:
+            failures.append((name, lon, lat, expected, zone))
+    for name, lon, lat, expected, zone in failures:
+        print(f"{name} ({lon}, {lat}): {zone} 系 (期待: {expected} 系)")
+    print(f"{len(CASES) - len(failures)} / {len(CASES)} 地点が一致")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク用のローカル標高タイルサーバー
+実際のサーバーに負荷をかけずに処理速度を測るため、合成した地形のタイルを返す。
+
+    python benchmarks/mock_tile_server.py --port 8765 --latency 30 --p404 0.05 --p429 0.02
+
+URL: http://127.0.0.1:<port>/<ソースキー>/{z}/{x}/{y}.<拡張子>  (産総研形式は {z}/{y}/{x})
+- 国土地理院形式 (gsi): 256px RGB PNG、NoDataは (128,0,0)
+- Q地図形式 (qmap): 512px WebP (GDALにWEBPドライバがなければPNG)、1つ上のズームで配信
+- 産総研形式 (gsj): 256px RGBA PNG、yx順、NoDataは透明
+各ソースは提供範囲 (経度の範囲) を持ち、範囲外は404を返す。
+"""
+
+import sys
+import math
+import time
+import zlib
+import struct
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+# ベンチマーク用のソース定義 (TILE_SOURCES と同じキーを使い、URLだけローカルに向ける)
+# coverage: データのある経度の範囲 / rate_limit: ローカルなので実質無制限にする
+MOCK_SOURCES = [
+    {"key": "qmap", "format": "qmap", "zoom": 17, "xy_order": "xy", "ext": "webp", "coverage": (139.0, 139.85)},
+    {"key": "chiriin", "format": "gsi", "zoom": 17, "xy_order": "xy", "ext": "png", "coverage": (139.0, 139.80)},
+    {"key": "tokyo", "format": "gsj", "zoom": 19, "xy_order": "yx", "ext": "png", "coverage": (139.0, 139.75)},
+    {"key": "fallback_dem5a", "format": "gsi", "zoom": 15, "xy_order": "xy", "ext": "png", "coverage": (139.0, 139.90)},
+    {"key": "fallback_dem5b", "format": "gsi", "zoom": 15, "xy_order": "xy", "ext": "png", "coverage": (139.0, 139.95)},
+    {"key": "fallback_dem5c", "format": "gsi", "zoom": 15, "xy_order": "xy", "ext": "png", "coverage": (139.0, 140.00)},
+    {"key": "fallback_dem10b", "format": "gsi", "zoom": 14, "xy_order": "xy", "ext": "png", "coverage": (-180.0, 180.0)},
+]
+
+
+def tile_sources_for(base_url, rate_limit=1000.0, max_concurrency=64):
+    """run_job に渡す sources (URLをモックサーバーに向けたもの)"""
+    sources = []
+    for m in MOCK_SOURCES:
+        if m["xy_order"] == "yx":
+            url = f"{base_url}/{m['key']}/{{z}}/{{y}}/{{x}}.{m['ext']}"
+        else:
+            url = f"{base_url}/{m['key']}/{{z}}/{{x}}/{{y}}.{m['ext']}"
+        sources.append({"key": m["key"], "name": m["key"], "zoom": m["zoom"], "url": url, "xy_order": m["xy_order"],
+                        "rate_limit": rate_limit, "max_concurrency": max_concurrency, "max_retries": 5})
+    return sources
+
+
+# ------------------------------------------------------------------------------
+# 合成地形と画像のエンコード
+# ------------------------------------------------------------------------------
+
+def synthetic_elevation(z, x, y, size=256):
+    """ズームをまたいで連続する合成地形 (m)。タイル内の各画素の経度・緯度から計算する"""
+    n = size << z
+    px = (x * size + np.arange(size) + 0.5) / n
+    py = (y * size + np.arange(size) + 0.5) / n
+    lon = px * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * py))))
+    elev = (200.0 + 250.0 * np.sin(lon[None, :] * 90.0) * np.cos(lat[:, None] * 70.0)
+            + 30.0 * np.sin(lon[None, :] * 2000.0 + lat[:, None] * 1500.0))
+    # 0m未満の区域を混ぜて、負の値とNoDataの扱いも通す
+    return elev.astype(np.float64) - 50.0, lon
+
+def encode_rgba(elev, fmt, nodata_mask):
+    """標高をタイル形式のRGB(A)配列にする"""
+    x = np.round(elev * 100).astype(np.int64)
+    if fmt == "gsi":
+        x = x & 0xFFFFFF  # 負の値は24bitの2の補数
+    else:
+        x = np.clip(x, 0, 0xFFFFFF)
+    rgba = np.empty(elev.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = x >> 16
+    rgba[..., 1] = (x >> 8) & 0xFF
+    rgba[..., 2] = x & 0xFF
+    rgba[..., 3] = 255
+    if fmt == "gsj":
+        rgba[nodata_mask, 3] = 0
+    else:
+        rgba[nodata_mask, :3] = (128, 0, 0)
+    return rgba if fmt == "gsj" else rgba[..., :3]
+
+def encode_png(arr):
+    """numpy配列 (高さ, 幅, 3 or 4) をPNGにする (zlibのみ使用)"""
+    height, width, channels = arr.shape
+    color_type = 6 if channels == 4 else 2
+    raw = b"".join(b"\x00" + arr[row].tobytes() for row in range(height))
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+def encode_webp(arr):
+    """GDALのWEBPドライバでロスレスWebPにする (使えなければPNG)"""
+    if gdal is None or gdal.GetDriverByName("WEBP") is None:
+        return encode_png(arr)
+    height, width, channels = arr.shape
+    mem = gdal.GetDriverByName("MEM").Create("", width, height, channels, gdal.GDT_Byte)
+    for i in range(channels):
+        mem.GetRasterBand(i + 1).WriteArray(arr[..., i])
+    path = f"/vsimem/mock_{threading.get_ident()}.webp"
+    gdal.GetDriverByName("WEBP").CreateCopy(path, mem, options=["LOSSLESS=TRUE"])
+    mem = None
+    f = gdal.VSIFOpenL(path, "rb")
+    gdal.VSIFSeekL(f, 0, 2)
+    size = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    data = gdal.VSIFReadL(1, size, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(path)
+    return data
+
+def render_tile(source, z, x, y):
+    """タイルの画像バイト列。提供範囲外ならNone"""
+    size = 512 if source["format"] == "qmap" else 256
+    elev, lon = synthetic_elevation(z, x, y, size)
+    lo, hi = source["coverage"]
+    outside = (lon < lo) | (lon > hi)
+    if outside.all():
+        return None
+    # 海面下の深い所はNoData (浅い所は国土地理院形式なら負の値のまま配信する)
+    nodata = np.broadcast_to(outside[None, :], elev.shape) | (elev < -80)
+    rgba = encode_rgba(elev, source["format"], nodata)
+    return encode_webp(rgba) if source["ext"] == "webp" else encode_png(rgba)
+
+
+# ------------------------------------------------------------------------------
+# HTTPサーバー
+# ------------------------------------------------------------------------------
+
+class MockTileServer:
+    """
+    別スレッドで動くモックサーバー。
+    latency: 応答までの遅延 (秒) / jitter: 遅延のばらつき (秒)
+    p404 / p429: 範囲内のタイルでも404・429を返す確率 (429にはRetry-Afterを付ける)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, p404=0.0, p429=0.0, seed=0):
+        self.latency, self.jitter, self.p404, self.p429 = latency, jitter, p404, p429
+        self.random = random.Random(seed)
+        self.sources = {m["key"]: m for m in MOCK_SOURCES}
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "200": 0, "404": 0, "429": 0, "bytes": 0}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body, headers = server.respond(self.path)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, path):
+        with self.lock:
+            self.counts["requests"] += 1
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+
+        try:
+            key, z, a, b = path.strip("/").split("/")
+            b = b.split(".")[0]
+            source = self.sources[key]
+            z, a, b = int(z), int(a), int(b)
+        except (ValueError, KeyError):
+            return self._count(404, b"", {})
+        x, y = (b, a) if source["xy_order"] == "yx" else (a, b)
+
+        if roll < self.p429:
+            return self._count(429, b"", {"Retry-After": "1"})
+        if roll < self.p429 + self.p404:
+            return self._count(404, b"", {})
+
+        tile_key = (key, z, x, y)
+        with self.lock:
+            body = self.cache.get(tile_key)
+        if body is None:
+            body = render_tile(source, z, x, y) or b""
+            with self.lock:
+                self.cache[tile_key] = body
+        if not body:
+            return self._count(404, b"", {})
+        ctype = "image/webp" if source["ext"] == "webp" and body[:4] == b"RIFF" else "image/png"
+        return self._count(200, body, {"Content-Type": ctype})
+
+    def _count(self, status, body, headers):
+        with self.lock:
+            self.counts[str(status)] += 1
+            self.counts["bytes"] += len(body)
+        return status, body, headers
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用のローカル標高タイルサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答遅延 (ミリ秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のばらつき (ミリ秒)")
+    parser.add_argument("--p404", type=float, default=0.0, help="404を返す確率")
+    parser.add_argument("--p429", type=float, default=0.0, help="429を返す確率")
+    args = parser.parse_args()
+
+    server = MockTileServer(args.host, args.port, args.latency / 1000.0, args.jitter / 1000.0, args.p404, args.p429)
+    print(f"serving on {server.base_url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
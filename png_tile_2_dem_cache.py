@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+タイルキャッシュ
+ダウンロード済みタイルをSQLiteに保存し、実行をまたいで再利用する。
+複数のQGISセッションから同時に開いても壊れないよう、WALモードで運用する。
+存在しない(404)タイルや全面NoDataのタイルも有効期限付きで記録し、再実行時に問い合わせを省く。
+実行中のデコード済み配列は MemoryTileCache でメモリに保持する (容量上限付き、実行ごとに空にする)。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "PNGTILE2DEM_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "png_tile_2_dem")
+)
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+DEFAULT_MISSING_TTL = 7 * 24 * 3600  # 欠損タイルの記録を信用する期間 (秒)
+DEFAULT_MEMORY_BYTES = 512 * 1024 ** 2  # 実行中にメモリに保持するデコード済み配列の上限
+
+MISSING = "missing"  # サーバーにタイルが存在しない
+EMPTY = "empty"      # タイルはあるが全面NoData
+
+
+class DiskTileCache:
+    """(ソースキー, z, x, y) をキーに生バイト列を保存する永続キャッシュ (LRU・容量上限付き)"""
+
+    # 容量チェックは毎回SUMを取ると重いので、この回数のputごとに行う
+    EVICT_CHECK_INTERVAL = 64
+    # 最終アクセス時刻は、記録がこれより古い場合だけ更新する (LRUの判定にはこの精度で十分)
+    ATIME_RESOLUTION = 3600.0
+    # 最終アクセス時刻の更新は、この件数まとめてから1回のトランザクションで書き込む
+    ATIME_BATCH = 256
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES, missing_ttl=DEFAULT_MISSING_TTL):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "tiles.sqlite")
+        self.max_bytes = int(max_bytes)
+        self.missing_ttl = float(missing_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self._local = threading.local()
+        self._conns = []  # 全スレッドの接続 (close() でまとめて閉じる)
+        self._conns_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._puts = 0
+        self._touched = []  # 最終アクセス時刻を更新するキー (まとめて書き込む)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            " source TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL,"
+            " data BLOB NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL,"
+            " PRIMARY KEY (source, z, x, y))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tiles_atime ON tiles (atime)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS missing ("
+            " source TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL,"
+            " kind TEXT NOT NULL, size INTEGER NOT NULL, expires REAL NOT NULL,"
+            " PRIMARY KEY (source, z, x, y))"
+        )
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに開く
+        # (使うのは開いたスレッドだけだが、close() は別スレッドから閉じるので check_same_thread=False)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            # WALモードでは NORMAL でも壊れない (電源断で直前のコミットが失われうるだけで、キャッシュには十分)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, source_key, z, x, y):
+        conn = self._conn()
+        try:
+            row = conn.execute(
+                "SELECT data, atime FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                (source_key, z, x, y)
+            ).fetchone()
+        except sqlite3.Error:
+            # ロック競合などでキャッシュが使えなくても処理自体は続行する
+            row = None
+
+        # ヒットのたびに書き込むと、温まった再実行がタイル数だけの書き込みトランザクションで律速されるため、
+        # 最終アクセス時刻は古くなったものだけを記録しておき、まとめて更新する
+        stale = row is not None and time.time() - row[1] > self.ATIME_RESOLUTION
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if stale:
+                self._touched.append((source_key, z, x, y))
+                flush = len(self._touched) >= self.ATIME_BATCH
+            else:
+                flush = False
+        if flush:
+            self.flush_atime()
+        return bytes(row[0])
+
+    def flush_atime(self):
+        """記録しておいたキーの最終アクセス時刻をまとめて更新する"""
+        with self._stats_lock:
+            touched, self._touched = self._touched, []
+        if not touched:
+            return
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.executemany(
+                "UPDATE tiles SET atime=? WHERE source=? AND z=? AND x=? AND y=?",
+                [(now,) + key for key in touched]
+            )
+            conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def put(self, source_key, z, x, y, content):
+        if self.max_bytes <= 0 or len(content) > self.max_bytes:
+            return
+        conn = self._conn()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles (source, z, x, y, data, size, atime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source_key, z, x, y, sqlite3.Binary(content), len(content), time.time())
+            )
+            conn.commit()
+        except sqlite3.Error:
+            return
+
+        with self._stats_lock:
+            self._puts += 1
+            check = self._puts % self.EVICT_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def get_missing(self, source_key, z, x, y):
+        """欠損として記録済みなら (種別, 画像サイズ) を返す。未記録・期限切れならNone"""
+        try:
+            row = self._conn().execute(
+                "SELECT kind, size FROM missing WHERE source=? AND z=? AND x=? AND y=? AND expires>?",
+                (source_key, z, x, y, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        with self._stats_lock:
+            self.negative_hits += 1
+        return row[0], int(row[1])
+
+    def put_missing(self, source_key, z, x, y, kind=MISSING, size=0):
+        if self.missing_ttl <= 0:
+            return
+        conn = self._conn()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO missing (source, z, x, y, kind, size, expires) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source_key, z, x, y, kind, size, time.time() + self.missing_ttl)
+            )
+            # 全面NoDataと分かったタイルの画像は保持しておく必要がない
+            conn.execute(
+                "DELETE FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                (source_key, z, x, y)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def contains(self, source_key, z, x, y):
+        """タイルまたは有効な欠損記録があればTrue (統計・最終アクセス時刻は更新しない)"""
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT 1 FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                (source_key, z, x, y)
+            ).fetchone() or conn.execute(
+                "SELECT 1 FROM missing WHERE source=? AND z=? AND x=? AND y=? AND expires>?",
+                (source_key, z, x, y, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None
+
+    def total_bytes(self):
+        row = self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()
+        return int(row[0])
+
+    def evict(self):
+        """容量上限を超えていれば、最終アクセスの古い順に上限の9割まで削除する"""
+        self.flush_atime()
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM missing WHERE expires<=?", (time.time(),))
+            conn.commit()
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return
+            target = int(self.max_bytes * 0.9)
+            while total > target:
+                rows = conn.execute(
+                    "SELECT source, z, x, y, size FROM tiles ORDER BY atime LIMIT 256"
+                ).fetchall()
+                if not rows:
+                    break
+                for source, z, x, y, size in rows:
+                    conn.execute(
+                        "DELETE FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                        (source, z, x, y)
+                    )
+                    total -= size
+                    if total <= target:
+                        break
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """全スレッドの接続を閉じる (ワーカースレッドが終わってから呼ぶ)"""
+        self.flush_atime()
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        # 閉じた接続を各スレッドが使い続けないよう、次の呼び出しで開き直させる
+        self._local = threading.local()
+
+
+class MemoryTileCache:
+    """
+    デコード済みの配列を実行中だけメモリに保持するキャッシュ (スレッド間で共有・LRU・容量上限付き)
+    値はFutureで持ち、同じキーを複数スレッドが同時に要求した場合は1回の取得・デコードの結果を待たせる。
+    容量は値の nbytes (とエントリごとの概算) の合計で数え、上限を超えたら最近使われていないものから捨てる。
+    取得中のものと、まだ使うタスクが残っているもの (pin) は上限を超えていても捨てない。
+    """
+
+    # Future・キーなど、値以外にエントリごとに掛かるメモリの概算 (欠損のNoneも件数に応じて数える)
+    ENTRY_BYTES = 512
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # キー -> Future (取得中のものも含む)
+        self._sizes = {}               # キー -> 数えたバイト数 (完了したもの)
+        self._pins = {}                # キー -> まだ使う予定のタスク数
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def reserve(self, key):
+        """
+        (Future, 取得する役か) を返す。初めて要求されたキーなら空のFutureを登録して取得役とし、
+        呼び出し側が set_result で値 (取得できなければNone) を入れる。
+        """
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self._entries.move_to_end(key)
+                return future, False
+            future = Future()
+            self._entries[key] = future
+            return future, True
+
+    def set_result(self, key, future, value):
+        """reserve で受け取ったFutureに値を入れ、容量を数えて上限を超えた分を捨てる"""
+        future.set_result(value)
+        size = getattr(value, "nbytes", 0) + self.ENTRY_BYTES
+        with self._lock:
+            if self._entries.get(key) is not future:
+                return  # 取得中に clear または捨てられた
+            self._sizes[key] = size
+            self.bytes += size
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self._evict()
+
+    def pin(self, key, count=1):
+        """count 個のタスクが後で使うキーを、release されるまで捨てないようにする (まだ取得していなくてもよい)"""
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + count
+
+    def release(self, key):
+        """pin したタスクが1つ終わったことを記録する。最後のタスクが終わった値はすぐに捨てる"""
+        with self._lock:
+            remaining = self._pins.get(key, 0) - 1
+            if remaining > 0:
+                self._pins[key] = remaining
+                return
+            self._pins.pop(key, None)
+            future = self._entries.get(key)
+            if future is not None and future.done():
+                self._drop(key)
+
+    def clear(self, max_bytes=None):
+        """すべてのエントリと pin を捨てる (max_bytes を渡すと上限も変える)"""
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = int(max_bytes)
+            self._entries.clear()
+            self._sizes.clear()
+            self._pins.clear()
+            self.bytes = self.peak_bytes = self.evictions = 0
+
+    def _drop(self, key):
+        del self._entries[key]
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        excess = self.bytes - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for key, future in self._entries.items():
+            if excess <= 0:
+                break
+            if key in self._pins or not future.done():
+                continue
+            victims.append(key)
+            excess -= self._sizes.get(key, 0)
+        for key in victims:
+            self._drop(key)
+        self.evictions += len(victims)
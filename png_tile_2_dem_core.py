@@ -0,0 +1,1306 @@
+# -*- coding: utf-8 -*-
+"""
+PngTile2Dem の処理本体 (QGISに依存しない)
+並列処理でWebタイルをダウンロードし、優先順位に従って合成、任意のCRSでGeoTIFFを出力する。
+QGISのアルゴリズム (png_tile_2_dem_algorithm) とコマンドライン (__main__) の両方から使う。
+"""
+
+import os
+import sys
+import math
+import time
+import tempfile
+import shutil
+import multiprocessing
+from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+from osgeo import gdal, osr
+
+from .png_tile_2_dem_sources import TILE_SOURCES, FALLBACK_KEYS, COVERAGE_ZOOM_OFFSET, tile_request
+from .png_tile_2_dem_decode import decode_image, tile_format, set_image_backend
+from .png_tile_2_dem_cache import (
+    DiskTileCache, MemoryTileCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_BYTES, DEFAULT_MEMORY_BYTES, MISSING, EMPTY
+)
+from .png_tile_2_dem_net import open_session, close_session, fetch_tile_bytes, set_rate_share
+from .png_tile_2_dem_job import JobCheckpoint, MOSAIC_FILE, CHUNKED_FILE
+from .png_tile_2_dem_stats import run_stats
+from .png_tile_2_dem_plan import (
+    plan_requests, estimate_seconds, load_history, record_run, summarize,
+    lonlat_to_tile, tile_range_for_lonlat, format_duration
+)
+
+gdal.SetConfigOption("GDAL_NUM_THREADS", "1")
+gdal.UseExceptions()
+MERCATOR_SRS = osr.SpatialReference(); MERCATOR_SRS.ImportFromEPSG(3857)
+MERCATOR_SRS.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+MOSAIC_MAX_TILES = 30000  # これを超える範囲は出力を分割して逐次処理する
+WINDOW_SIZE = 4096        # 分割処理時の1ウィンドウの大きさ (出力画素)
+
+# 出力GeoTIFFの形式
+# layout: "auto" (COG_MIN_PIXELS 以上ならCOG) / "cog" (内部オーバービュー付きのCloud-Optimized GeoTIFF) / "gtiff"
+# compress: OUTPUT_COMPRESSIONS のいずれか / max_z_error: LERC系の許容誤差 (m)
+# int_cm: センチメートル単位のInt32で保存する (スケール0.01を設定するので読み込み側ではmになる)
+OUTPUT_LAYOUTS = ("auto", "cog", "gtiff")
+OUTPUT_COMPRESSIONS = ("DEFLATE", "ZSTD", "LERC", "LERC_DEFLATE", "LERC_ZSTD", "NONE")
+DEFAULT_OUTPUT_OPTIONS = {"layout": "auto", "compress": "DEFLATE", "max_z_error": 0.0, "int_cm": False}
+COG_MIN_PIXELS = 2048 * 2048  # layout="auto" でCOGにする出力の大きさ (画素数)
+
+# 実行中にメモリに保持するデコード済み配列 (容量は run_job の memory_bytes で決める)
+PARENT_CACHE_SHARE = 0.25  # 容量のうち低解像度の親タイル (値・マスク) に使う割合
+tile_cache = MemoryTileCache(DEFAULT_MEMORY_BYTES * (1 - PARENT_CACHE_SHARE))  # URL -> デコード結果
+disk_cache = None        # 実行をまたいで使う永続キャッシュ (run_jobで設定)
+NEGATIVE_CACHE_STATUS = (204, 404, 410)  # 「タイルが存在しない」として記録するステータス
+
+coverage_index = {}      # (ソースキー, z, x, y) -> データのある画素のビットマップ (判定不能ならNone)
+coverage_stats = {"skipped": 0}
+coverage_lock = Lock()
+
+
+# (ソースキー, z, x, y) -> 親タイルの [値, マスク]。同じ親を使う子タイルが残っている間は pin して捨てない
+parent_cache = MemoryTileCache(DEFAULT_MEMORY_BYTES * PARENT_CACHE_SHARE)
+
+# プロセス並列時のパイプライン (親プロセス: 取得 / ワーカープロセス: デコード・合成)
+io_executor = None       # 親プロセスで主ソースのタイルを取得するスレッドプール (run_jobで設定)
+decode_processes = 0     # デコード・合成を行うワーカープロセス数 (0ならスレッドのみ)
+PIPELINE_DEPTH = 4       # ワーカー1つあたりに先行して取得・投入しておくタスク数
+THREAD_IN_FLIGHT = 128   # スレッド並列時に先行して投入しておくタスク数 (残りは完了に合わせて順に投入する)
+PREFETCH_CACHE_MAX = 512 # 親プロセスで取得したバイト列を保持する上限 (512pxタイルを4タスクで共有するため)
+prefetch_cache = OrderedDict()  # URL -> (ステータス, バイト列) のFuture
+prefetch_lock = Lock()
+prefetched_content = {}  # ワーカー側: 親プロセスから受け取った URL -> (ステータス, バイト列)
+
+
+class PngTile2DemError(Exception):
+    """処理を続行できないエラー (QGIS上では QgsProcessingException に変換して表示する)"""
+
+
+class ConsoleFeedback:
+    """QgsProcessingFeedback と同じ呼び出し方で進捗を表示する (コマンドライン用)"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self._progress = -1
+
+    def pushInfo(self, message):
+        if not self.quiet:
+            print(message, flush=True)
+
+    def reportError(self, message, fatalError=False):
+        print(message, file=sys.stderr, flush=True)
+
+    def setProgress(self, progress):
+        progress = int(progress)
+        if not self.quiet and progress != self._progress and progress % 10 == 0:
+            print(f"{progress}%", flush=True)
+        self._progress = progress
+
+    def isCanceled(self):
+        return False
+
+# ==============================================================================
+# ヘルパー関数
+# ==============================================================================
+
+def tile_bounds_mercator(x, y, z):
+    n = 2.0 ** z
+    lon_left = x / n * 360.0 - 180.0
+    lon_right = (x + 1) / n * 360.0 - 180.0
+    lat_top = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_bottom = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+
+    def latlon_to_merc(lon, lat):
+        R = 6378137.0
+        x_m = R * math.radians(lon)
+        lat = max(min(lat, 89.9999), -89.9999)
+        y_m = R * math.log(math.tan(math.pi / 4.0 + math.radians(lat) / 2.0))
+        return x_m, y_m
+
+    minx, maxy = latlon_to_merc(lon_left, lat_top)
+    maxx, miny = latlon_to_merc(lon_right, lat_bottom)
+    return minx, miny, maxx, maxy
+
+def hilbert_index(z, x, y):
+    """ズーム z のタイル (x, y) が、全体を覆うヒルベルト曲線上で何番目か"""
+    n = 1 << z
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+def spatial_order(tiles, z):
+    """
+    タイル (x, y) の並びをヒルベルト曲線の順にする。曲線は全体のタイル格子に揃えているので、
+    どのズームの親タイル (512pxのQ地図、5m・10mDEMなど) についても、その子タイルが続けて並ぶ。
+    """
+    return sorted(tiles, key=lambda t: hilbert_index(z, t[0], t[1]))
+
+# ==============================================================================
+# リサイズ処理 (デコードは png_tile_2_dem_decode)
+# ==============================================================================
+
+# 補間の計画 (各軸の下側の添字と重み) は出力の形ごとに使い回す。
+# 縮小は 256 -> 2^k、拡大は親タイルの窓 (ズーム差と穴の矩形で決まる) なので、形の種類は少ない
+RESAMPLE_PLAN_MAX = 256  # 保持する計画の上限数
+resample_plans = OrderedDict()
+resample_plan_lock = Lock()
+
+# 高ズームのサブタイルを縮小する方法
+# "bilinear": これまでと同じバイリニア補間 / "average": 2のべき乗の縮小をブロック平均で行う (エイリアスが少ない)
+DOWNSAMPLE_METHOD = "bilinear"
+
+
+def axis_plan(src_n, dst_n, start, count):
+    """linspace(0, src_n - 1, dst_n) の [start:start+count] に対する下側の添字と重み (float32)"""
+    pos = np.arange(start, start + count, dtype=np.float64) * ((src_n - 1) / max(dst_n - 1, 1))
+    idx = np.clip(np.floor(pos).astype(np.intp), 0, src_n - 2)
+    return idx, (pos - idx).astype(np.float32)[:, None]
+
+
+def resample_plan(src_shape, dst_shape, row0=0, col0=0, win_h=None, win_w=None):
+    """(縦の添字・重み, 横の添字・重み)。形と窓が同じ呼び出しでは計算済みのものを返す"""
+    win_h = dst_shape[0] if win_h is None else win_h
+    win_w = dst_shape[1] if win_w is None else win_w
+    key = (src_shape, dst_shape, row0, col0, win_h, win_w)
+    with resample_plan_lock:
+        plan = resample_plans.get(key)
+        if plan is not None:
+            resample_plans.move_to_end(key)
+            return plan
+    y_idx, y_w = axis_plan(src_shape[0], dst_shape[0], row0, win_h)
+    x_idx, x_w = axis_plan(src_shape[1], dst_shape[1], col0, win_w)
+    plan = (y_idx, y_w, x_idx, x_w.ravel())
+    with resample_plan_lock:
+        resample_plans[key] = plan
+        while len(resample_plans) > RESAMPLE_PLAN_MAX:
+            resample_plans.popitem(last=False)
+    return plan
+
+
+def apply_plan(planes, plan):
+    """
+    (..., h, w) の配列を計画に従ってバイリニア補間する (float32)。
+    縦方向・横方向の順に1次元の補間を行うので、4点の重み付き和と同じ結果を少ない読み出しで得られる。
+    先頭の次元 (値とマスクなど) はまとめて処理する。
+    """
+    y_idx, y_w, x_idx, x_w = plan
+    top = planes[..., y_idx, :]
+    rows = top + (planes[..., y_idx + 1, :] - top) * y_w
+    left = rows[..., x_idx]
+    return left + (rows[..., x_idx + 1] - left) * x_w
+
+
+def resize_array_bilinear(arr, new_size):
+    """Pillowの代わりに使用するNumpyベースのバイリニアリサイズ関数"""
+    if arr.shape == tuple(new_size): return arr.astype(np.float32)
+    return apply_plan(arr.astype(np.float32, copy=False), resample_plan(arr.shape, tuple(new_size)))
+
+def resize_window_bilinear(arr, new_size, row0, col0, win_h, win_w):
+    """resize_array_bilinear(arr, new_size) の [row0:row0+win_h, col0:col0+win_w] だけを計算する"""
+    plan = resample_plan(arr.shape, tuple(new_size), row0, col0, win_h, win_w)
+    return apply_plan(arr.astype(np.float32, copy=False), plan)
+
+# ==============================================================================
+# マスクを用いた正規化リサイズ (NaNを含むタイル用)
+# 値 (NaNを0にしたもの) とマスクを1つの配列に重ねて同時に補間し、補間後のマスクで割って境界を補正する
+# ==============================================================================
+
+def value_mask_planes(dem):
+    """NaNを含む標高から [値 (NaNは0), マスク] の2面の配列 (float32) を作る"""
+    planes = np.empty((2,) + dem.shape, dtype=np.float32)
+    valid = ~np.isnan(dem)
+    planes[1] = valid
+    np.copyto(planes[0], dem)
+    planes[0][~valid] = 0.0
+    return planes
+
+
+def normalize_planes(res):
+    """補間後の [値, マスク] から標高を求める (マスクが 0.01 以下の画素はNaN)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(res[1] > 0.01, res[0] / res[1], np.nan).astype(np.float32, copy=False)
+
+
+def downsample_average(planes, factor):
+    """[値, マスク] を factor x factor のブロック平均で縮小する (大きさが factor で割り切れること)"""
+    _, h, w = planes.shape
+    return planes.reshape(2, h // factor, factor, w // factor, factor).mean(axis=(2, 4), dtype=np.float32)
+
+
+def resize_normalized(dem, new_size):
+    """NaNを含む標高をマスクで正規化して縮小・拡大する"""
+    planes = value_mask_planes(dem)
+    (h, w), (new_h, new_w) = dem.shape, new_size
+    factor = h // new_h
+    if (DOWNSAMPLE_METHOD == "average" and factor > 1 and factor & (factor - 1) == 0
+            and (h, w) == (new_h * factor, new_w * factor)):
+        return normalize_planes(downsample_average(planes, factor))
+    return normalize_planes(apply_plan(planes, resample_plan(dem.shape, (new_h, new_w))))
+
+# ==============================================================================
+# タイル処理ロジック (並列実行される)
+# ==============================================================================
+
+def decode_tile_image(content, source, keep_512):
+    """画像のバイト列を標高配列にデコードする (keep_512: 512pxタイルを切り出し前のまま返す)"""
+    # 読み込みに使うバックエンド (GDAL / QImage) は png_tile_2_dem_decode で切り替える
+    with run_stats.timer("decode"):
+        return decode_image(content, tile_format(source), keep_512)
+
+def configure_memory_cache(memory_bytes):
+    """メモリ上のキャッシュを空にし、容量 memory_bytes をデコード済みタイルと親タイルに分ける"""
+    tile_cache.clear(memory_bytes * (1 - PARENT_CACHE_SHARE))
+    parent_cache.clear(memory_bytes * PARENT_CACHE_SHARE)
+
+def get_decoded_tile(source, z, x, y, keep_512=False):
+    """
+    タイルを取得・デコードして返す (取得できなければNone)。
+    同じURLを複数スレッドが同時に要求した場合は1回だけ取得・デコードし、
+    他のスレッドはFutureで結果 (失敗も含む) を待つ。
+    """
+    url = source["url"].format(z=z, x=x, y=y)
+
+    future, is_owner = tile_cache.reserve(url)
+    if not is_owner:
+        return future.result()
+
+    dem = None
+    try:
+        # 既知の欠損タイルは問い合わせない (全面NoDataならNaNの配列をそのまま返す)
+        known = disk_cache.get_missing(source["key"], z, x, y) if disk_cache is not None else None
+        if known is not None:
+            kind, size = known
+            if kind == EMPTY and size > 0:
+                dem = np.full((size, size), np.nan, dtype=np.float32)
+                dem.setflags(write=False)
+            content = None
+        else:
+            # 実行をまたいだディスクキャッシュにあればネットワークに出ない
+            content = disk_cache.get(source["key"], z, x, y) if disk_cache is not None else None
+            from_disk = content is not None
+            if content is None:
+                # ホストごとのレート制御・再試行は fetch_tile_bytes 側で行う
+                # (プロセス並列時は、親プロセスが取得済みのバイト列を使う)
+                if url in prefetched_content:
+                    status, content = prefetched_content.pop(url)
+                else:
+                    status, content = fetch_tile_bytes(url, source)
+                if status in NEGATIVE_CACHE_STATUS and disk_cache is not None:
+                    disk_cache.put_missing(source["key"], z, x, y, MISSING)
+
+        if content:
+            dem = decode_tile_image(content, source, keep_512)
+            if dem is not None:
+                # 共有する配列なので、誤って書き換えられないよう読み取り専用にする
+                dem.setflags(write=False)
+                if disk_cache is not None:
+                    if np.isnan(dem).all():
+                        disk_cache.put_missing(source["key"], z, x, y, EMPTY, dem.shape[0])
+                    elif not from_disk:
+                        disk_cache.put(source["key"], z, x, y, content)
+    except Exception:
+        dem = None
+    finally:
+        # 容量を超えた分は、取得が終わった古いエントリから捨てる
+        tile_cache.set_result(url, future, dem)
+    return dem
+
+
+def fetch_and_decode(source, x, y, z):
+    """ソースの (z, x, y) タイルを256pxの標高配列として返す (取得できなければNone)"""
+    req_z, req_x, req_y, needs_quad_crop = tile_request(source, x, y, z)
+
+    dem = get_decoded_tile(source, req_z, req_x, req_y, needs_quad_crop)
+    if dem is None: return None
+
+    # 512pxタイルはデコード済みの配列から該当する1/4を切り出す
+    if needs_quad_crop and dem.shape == (512, 512):
+        quad_x = x % 2
+        quad_y = y % 2
+        return dem[quad_y * 256:(quad_y + 1) * 256, quad_x * 256:(quad_x + 1) * 256]
+    return dem
+
+# ==============================================================================
+# カバレッジ索引 (提供範囲外のタイルへのリクエストを省く)
+# ==============================================================================
+
+def coverage_zoom_of(source):
+    """カバレッジ判定に使うズームレベル。Noneならそのソースは常に取得を試みる"""
+    if source["key"].startswith("fallback_"):
+        return None
+    return source.get("coverage_zoom", source["zoom"] - COVERAGE_ZOOM_OFFSET)
+
+def get_coverage_bitmap(source, cz, cx, cy):
+    """
+    低ズームのタイルから「データのある画素」のビットマップを作る。
+    タイルが取得できない場合は判定不能としてNoneを返す。
+    """
+    key = (source["key"], cz, cx, cy)
+    with coverage_lock:
+        if key in coverage_index:
+            return coverage_index[key]
+
+    dem = fetch_and_decode(source, cx, cy, cz)
+    bitmap = None if dem is None else ~np.isnan(dem)
+    with coverage_lock:
+        coverage_index[key] = bitmap
+    return bitmap
+
+def source_covers(source, z, x, y, count=True):
+    """
+    (z, x, y) のタイルにデータがある可能性があればTrue。確実に範囲外と分かる場合だけFalse
+    count: 省略したリクエストとして集計するか
+    """
+    cz = coverage_zoom_of(source)
+    if cz is None or cz < 0 or z <= cz:
+        return True
+
+    shift = z - cz
+    cx, cy = x >> shift, y >> shift
+    bitmap = get_coverage_bitmap(source, cz, cx, cy)
+    if bitmap is None:
+        return True
+
+    # 低ズームタイル上で対象タイルが占める画素範囲 (縮小時の誤差を考えて1画素広げる)
+    size = bitmap.shape[0] / (1 << shift)
+    px0 = (x - (cx << shift)) * size
+    py0 = (y - (cy << shift)) * size
+    c0, c1 = max(0, int(math.floor(px0)) - 1), min(bitmap.shape[1], int(math.ceil(px0 + size)) + 1)
+    r0, r1 = max(0, int(math.floor(py0)) - 1), min(bitmap.shape[0], int(math.ceil(py0 + size)) + 1)
+    if bitmap[r0:r1, c0:c1].any():
+        return True
+
+    if count:
+        with coverage_lock:
+            coverage_stats["skipped"] += 1
+    return False
+
+def process_single_tile_composite(args):
+    bx, by, BASE_Z, primary_key, active_sources, nodata = args
+    tile_size = 256
+    composite_dem = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
+    # まだ埋まっていない画素 (合成のたびに isnan を取り直さず、埋めた分だけ更新する)
+    holes = np.ones((tile_size, tile_size), dtype=bool)
+
+    def get_scaled_dem(src_key, target_bx, target_by, target_z):
+            """
+            改良版：マスクを使用した正規化バイリニア補間
+            穴 (holes) に掛からないサブタイルは取得せず、拡大時は穴を含む範囲だけを補間する
+            (計算しなかった画素はNaN)
+            """
+            source = next(s for s in active_sources if s["key"] == src_key)
+            src_z = source["zoom"]
+
+            # 提供範囲外と分かっているソースにはリクエストを出さない
+            if not source_covers(source, target_z, target_bx, target_by):
+                return None
+            
+            if src_z == target_z:
+                return fetch_and_decode(source, target_bx, target_by, target_z)
+            
+            elif src_z > target_z:
+                # --- 高解像度ソースを縮小して結合する場合 ---
+                # (基準ズームは主ソースのズームで、同梱のQ地図・補完用ソースはそれより高くないため、
+                #  ここを通るのはズームの高い補完用ソースを sources に加えた場合だけ)
+                shift = src_z - target_z
+                scale = 1 << shift
+                sub_tile_res = tile_size // scale
+                full_res_dem = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
+                
+                any_data = False
+                for dx in range(scale):
+                    for dy in range(scale):
+                        sub_x, sub_y = (target_bx << shift) + dx, (target_by << shift) + dy
+                        # サブタイルは個別に縮小するので、穴のない区画は取得しなくても結果は変わらない
+                        if not holes[dy*sub_tile_res:(dy+1)*sub_tile_res, dx*sub_tile_res:(dx+1)*sub_tile_res].any():
+                            continue
+                        if not source_covers(source, src_z, sub_x, sub_y):
+                            continue
+                        sub_dem = fetch_and_decode(source, sub_x, sub_y, src_z)
+                        if sub_dem is not None:
+                            any_data = True
+                            t0 = time.perf_counter()
+                            # マスクで正規化して縮小 (値とマスクを1回の補間でまとめて処理)
+                            res_dem = resize_normalized(sub_dem, (sub_tile_res, sub_tile_res))
+                            full_res_dem[dy*sub_tile_res:(dy+1)*sub_tile_res, dx*sub_tile_res:(dx+1)*sub_tile_res] = res_dem
+                            run_stats.add_time("resample", time.perf_counter() - t0)
+                return full_res_dem if any_data else None
+                
+            else:
+                # --- 低解像度ソースを拡大して切り出す場合 ---
+                shift = target_z - src_z
+                scale = 1 << shift
+                src_x, src_y = target_bx >> shift, target_by >> shift
+
+                # 同じ親タイルを共有する子タイル間で、デコード・正規化済みの値とマスクを使い回す
+                future, is_owner = parent_cache.reserve((src_key, src_z, src_x, src_y))
+                if is_owner:
+                    planes = None
+                    try:
+                        parent_dem = fetch_and_decode(source, src_x, src_y, src_z)
+                        # [値, マスク] の2面にしておき、子タイルの窓ごとにまとめて補間する
+                        if parent_dem is not None:
+                            planes = value_mask_planes(parent_dem)
+                    finally:
+                        parent_cache.set_result((src_key, src_z, src_x, src_y), future, planes)
+                else:
+                    planes = future.result()
+                if planes is None: return None
+
+                # 拡大後の全体ではなく、この子タイルのうち穴を含む矩形に対応する窓だけを補間する
+                dx, dy = target_bx & (scale - 1), target_by & (scale - 1)
+                big_size = (tile_size * scale, tile_size * scale)
+                rows, cols = np.flatnonzero(holes.any(axis=1)), np.flatnonzero(holes.any(axis=0))
+                r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+                with run_stats.timer("resample"):
+                    plan = resample_plan(planes.shape[1:], big_size, dy * tile_size + r0, dx * tile_size + c0, r1 - r0, c1 - c0)
+                    res_dem = np.full((tile_size, tile_size), np.nan, dtype=np.float32)
+                    res_dem[r0:r1, c0:c1] = normalize_planes(apply_plan(planes, plan))
+                    return res_dem
+
+    def fill_holes(src_key, res):
+        """穴 (NaN) の部分だけを res で埋め、埋めた画素があればソースごとの集計に数える"""
+        with run_stats.timer("composite"):
+            mask = holes & ~np.isnan(res)
+            if mask.any():
+                composite_dem[mask] = res[mask]
+                holes[mask] = False
+                run_stats.add_fill(src_key)
+
+    # --- 合成ステップ ---
+    # 1. プライマリ
+    res = get_scaled_dem(primary_key, bx, by, BASE_Z)
+    if res is not None: fill_holes(primary_key, res)
+    
+    # 2. Q地図補完 (プライマリがQ地図でない場合)
+    if primary_key != "qmap" and holes.any():
+        res = get_scaled_dem("qmap", bx, by, BASE_Z)
+        if res is not None: fill_holes("qmap", res)
+            
+    # ★追加: フォールバック（5m等）で穴埋めされる「前」に、高解像度データが全く取れなかったかを判定
+    high_res_missing = bool(holes.all())
+
+    # 3. フォールバック
+    for fb in FALLBACK_KEYS:
+        if not holes.any(): break
+        res = get_scaled_dem(fb, bx, by, BASE_Z)
+        if res is not None: fill_holes(fb, res)
+
+    # 出力 (ファイルには書かず、メインスレッドで1枚のモザイクに書き込む)
+    # 全面NoDataのタイルは書き込み不要なのでNoneを返す
+    if holes.all():
+        return bx, by, None, high_res_missing
+    h_filled = np.where(holes, nodata, composite_dem).astype(np.float32)
+    # ★修正: 高解像度データの欠損フラグ(high_res_missing)も一緒に返す
+    return bx, by, h_filled, high_res_missing
+
+def create_mosaic_dataset(path, tx_start, ty_start, tx_end, ty_end, z, nodata, tile_size=256, driver_name="GTiff"):
+    """
+    タイル範囲全体を覆う EPSG:3857 のラスタを作る。
+    GTiff: タイル化・スパースなGeoTIFF (未書き込みのブロックはNoData扱い)
+    MEM: メモリ上のデータセット (NoDataで初期化) / VRT: 画素を持たない範囲だけのデータセット
+    """
+    minx, _, _, maxy = tile_bounds_mercator(tx_start, ty_start, z)
+    _, miny, maxx, _ = tile_bounds_mercator(tx_end, ty_end, z)
+    width = (tx_end - tx_start + 1) * tile_size
+    height = (ty_end - ty_start + 1) * tile_size
+
+    options = []
+    if driver_name == "GTiff":
+        options = ["TILED=YES", f"BLOCKXSIZE={tile_size}", f"BLOCKYSIZE={tile_size}", "SPARSE_OK=TRUE", "BIGTIFF=IF_SAFER"]
+    driver = gdal.GetDriverByName(driver_name)
+    ds = driver.Create(path, width, height, 1, gdal.GDT_Float32, options=options)
+    ds.SetGeoTransform((minx, (maxx - minx) / width, 0, maxy, 0, -(maxy - miny) / height))
+    ds.SetProjection(MERCATOR_SRS.ExportToWkt())
+    ds.GetRasterBand(1).SetNoDataValue(nodata)
+    if driver_name == "MEM":
+        ds.GetRasterBand(1).Fill(nodata)
+    return ds
+
+def suggest_resolution(src_ds, dst_wkt):
+    """出力CRSでGDALが推奨する解像度 (XとYの平均で正方形にそろえる)"""
+    tmp_warp = gdal.AutoCreateWarpedVRT(src_ds, None, dst_wkt, gdal.GRA_NearestNeighbour)
+    gt = tmp_warp.GetGeoTransform()
+    return (abs(gt[1]) + abs(gt[5])) / 2.0
+
+def transform_bounds(ct, bounds, densify=21):
+    """矩形 (minx, miny, maxx, maxy) の外周を細かく変換し、変換先での外接矩形を返す"""
+    minx, miny, maxx, maxy = bounds
+    xs, ys = [], []
+    for i in range(densify):
+        t = i / (densify - 1)
+        for px, py in ((minx + (maxx - minx) * t, miny), (minx + (maxx - minx) * t, maxy),
+                       (minx, miny + (maxy - miny) * t), (maxx, miny + (maxy - miny) * t)):
+            x, y, _ = ct.TransformPoint(px, py)
+            xs.append(x); ys.append(y)
+    return min(xs), min(ys), max(xs), max(ys)
+
+def mercator_bounds_to_tiles(bounds, z):
+    """EPSG:3857 の矩形に掛かるタイル範囲 (tx0, ty0, tx1, ty1)"""
+    origin = 20037508.342789244
+    span = 2 * origin / (1 << z)
+    minx, miny, maxx, maxy = bounds
+    tx0 = int(math.floor((minx + origin) / span))
+    tx1 = int(math.floor((maxx + origin) / span))
+    ty0 = int(math.floor((origin - maxy) / span))
+    ty1 = int(math.floor((origin - miny) / span))
+    return tx0, ty0, tx1, ty1
+
+def task_parent_keys(task):
+    """タスクが拡大して使う可能性のある低解像度ソースの親タイルのキー (parent_cache のキー)"""
+    bx, by, BASE_Z, primary_key, active_sources, nodata = task
+    keys = [primary_key] + (["qmap"] if primary_key != "qmap" else []) + FALLBACK_KEYS
+    for source in active_sources:
+        if source["key"] in keys and source["zoom"] < BASE_Z:
+            shift = BASE_Z - source["zoom"]
+            yield source["key"], source["zoom"], bx >> shift, by >> shift
+
+def composite_tiles(executor, tasks, feedback, on_result):
+    """
+    タスクを並列に合成し、完了したものから on_result(bx, by, dem, high_res_missing) を呼ぶ。
+    キャンセルされた場合はFalseを返す。
+    """
+    if io_executor is not None:
+        return composite_tiles_pipelined(executor, tasks, feedback, on_result)
+    # 親タイルは、それを使う子タイルのタスクがすべて終わるまで容量に関係なく残し、終わったらすぐに捨てる
+    for task in tasks:
+        for key in task_parent_keys(task):
+            parent_cache.pin(key)
+    # 一度に投入するのは THREAD_IN_FLIGHT 件までとし、並び順 (spatial_order) のとおりに処理が進むようにする。
+    # 完了したFutureは手放して、合成済み配列がメモリに残り続けないようにする
+    task_iter = iter(tasks)
+    pending = {}
+
+    def fill():
+        while len(pending) < THREAD_IN_FLIGHT:
+            task = next(task_iter, None)
+            if task is None:
+                return
+            pending[executor.submit(process_single_tile_composite, task)] = task
+
+    fill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        if feedback.isCanceled():
+            for f in pending: f.cancel()
+            return False
+        for future in done:
+            task = pending.pop(future)
+            for key in task_parent_keys(task):
+                parent_cache.release(key)
+            on_result(*future.result())
+        fill()
+    return True
+
+# ==============================================================================
+# プロセス並列 (デコード・合成をワーカープロセスで行い、GILの競合を避ける)
+# ==============================================================================
+
+def worker_python_executable():
+    """
+    ワーカープロセスの起動に使うPythonの実行ファイル (見つからなければNone)。
+    QGIS上では sys.executable がQGIS本体 (qgis-bin.exe など) なので、同梱のPythonを探す。
+    """
+    exe = sys.executable or ""
+    if os.path.basename(exe).lower().startswith("python"):
+        return exe
+    if os.name == "nt":
+        names = ["pythonw.exe", "python.exe"]
+    else:
+        version = f"{sys.version_info.major}.{sys.version_info.minor}"
+        names = [os.path.join("bin", f"python{version}"), os.path.join("bin", "python3"), f"python{version}", "python3"]
+    for prefix in dict.fromkeys([sys.exec_prefix, sys.base_exec_prefix, os.path.dirname(exe)]):
+        for name in names:
+            path = os.path.join(prefix, name)
+            if prefix and os.path.isfile(path):
+                return path
+    return None
+
+def process_mode_blocker(primary_key, sources):
+    """
+    ワーカープロセスでデコードできない理由 (なければNone)。
+    ワーカーはGDALでしかデコードしないので、WebPのソースを使うのにWEBPドライバがなければ使えない。
+    """
+    keys = [primary_key] + (["qmap"] if primary_key != "qmap" else []) + FALLBACK_KEYS
+    webp = [s["key"] for s in sources if s["key"] in keys and s["url"].lower().endswith(".webp")]
+    if webp and gdal.GetDriverByName("WEBP") is None:
+        return f"このGDALにはWEBPドライバがなく、WebPのソース ({', '.join(webp)}) をワーカープロセスでデコードできません"
+    return None
+
+def init_decode_worker(cache_dir, cache_bytes, rate_share, max_connections, memory_bytes):
+    """ワーカープロセスの初期化 (ProcessPoolExecutor の initializer)"""
+    global disk_cache
+    # タスクはワーカー間で振り分けられるので、親タイルの pin は行わず容量上限のLRUだけで管理する
+    configure_memory_cache(memory_bytes)
+    # ワーカーにはQtのアプリケーションがないため、デコードはGDALで行う
+    set_image_backend("gdal")
+    disk_cache = None
+    if cache_bytes > 0:
+        try:
+            disk_cache = DiskTileCache(cache_dir, cache_bytes)
+        except Exception:
+            disk_cache = None
+    # 補完用ソースはワーカーが直接取得するので、ホストごとの上限をプロセス間で分け合う
+    set_rate_share(rate_share)
+    open_session(max_connections_per_host=max_connections)
+
+def worker_counters():
+    """親プロセスへ返す統計 (カバレッジで省略した件数, キャッシュのヒット, ミス, 既知の欠損)"""
+    if disk_cache is None:
+        return coverage_stats["skipped"], 0, 0, 0
+    return coverage_stats["skipped"], disk_cache.hits, disk_cache.misses, disk_cache.negative_hits
+
+def process_tile_in_worker(args, prefetched):
+    """ワーカープロセスで1タイルを合成し、結果に統計の増分と計測値を付けて返す"""
+    before = worker_counters()
+    run_stats.reset()
+    prefetched_content.update(prefetched)
+    try:
+        result = process_single_tile_composite(args)
+    finally:
+        prefetched_content.clear()
+    after = worker_counters()
+    return result + (tuple(a - b for a, b in zip(after, before)), run_stats.snapshot())
+
+def merge_worker_counters(counters):
+    skipped, hits, misses, negative_hits = counters
+    with coverage_lock:
+        coverage_stats["skipped"] += skipped
+    if disk_cache is not None:
+        disk_cache.hits += hits
+        disk_cache.misses += misses
+        disk_cache.negative_hits += negative_hits
+
+def prefetch_tile_bytes(args):
+    """
+    I/O段: タスクの主ソースのタイルを親プロセスで取得し、ワーカーに渡す {URL: (ステータス, バイト列)} を返す。
+    ディスクキャッシュにあるもの・提供範囲外のものはワーカー側で処理するため渡さない。
+    """
+    bx, by, BASE_Z, primary_key, active_sources, nodata = args
+    source = find_source(primary_key, active_sources)
+    # 省略件数はワーカー側で集計されるので、ここでは数えない
+    if not source_covers(source, BASE_Z, bx, by, count=False):
+        return {}
+    req_z, req_x, req_y, _ = tile_request(source, bx, by, BASE_Z)
+    if disk_cache is not None and disk_cache.contains(source["key"], req_z, req_x, req_y):
+        return {}
+    url = source["url"].format(z=req_z, x=req_x, y=req_y)
+
+    # 512pxタイルは4タスクで同じURLを使うので、取得は1回にまとめる
+    with prefetch_lock:
+        future = prefetch_cache.get(url)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            prefetch_cache[url] = future
+    if is_owner:
+        try:
+            result = fetch_tile_bytes(url, source)
+        except Exception:
+            result = (None, None)
+        future.set_result(result)
+        with prefetch_lock:
+            while len(prefetch_cache) > PREFETCH_CACHE_MAX:
+                oldest_url, oldest = next(iter(prefetch_cache.items()))
+                if not oldest.done():
+                    break
+                del prefetch_cache[oldest_url]
+    return {url: future.result()}
+
+def composite_tiles_pipelined(executor, tasks, feedback, on_result):
+    """
+    プロセス並列時の composite_tiles。
+    I/O段 (io_executor のスレッド) で主ソースのタイルを取得し、取れたものから順に
+    デコード・合成段 (executor のワーカープロセス) へ渡す。先行させるタスク数は
+    ワーカー数 x PIPELINE_DEPTH までに抑え、取得済みのバイト列がメモリに溜まらないようにする。
+    """
+    max_in_flight = max(1, decode_processes) * PIPELINE_DEPTH
+    task_iter = iter(tasks)
+    fetching = {}     # 取得中のFuture -> タスク
+    compositing = set()
+
+    def fill():
+        while len(fetching) + len(compositing) < max_in_flight:
+            task = next(task_iter, None)
+            if task is None:
+                return
+            fetching[io_executor.submit(prefetch_tile_bytes, task)] = task
+
+    fill()
+    while fetching or compositing:
+        done, _ = wait(set(fetching) | compositing, return_when=FIRST_COMPLETED)
+        if feedback.isCanceled():
+            for f in list(fetching) + list(compositing): f.cancel()
+            return False
+        for future in done:
+            if future in fetching:
+                task = fetching.pop(future)
+                compositing.add(executor.submit(process_tile_in_worker, task, future.result()))
+            else:
+                compositing.discard(future)
+                *result, counters, snapshot = future.result()
+                merge_worker_counters(counters)
+                run_stats.merge(snapshot)
+                on_result(*result)
+        fill()
+    return True
+
+# ==============================================================================
+# 出力 (モザイク / 分割処理)
+# ==============================================================================
+
+def supported_compressions():
+    """このGDALのGTiffドライバで使える圧縮方式"""
+    option_list = gdal.GetDriverByName("GTiff").GetMetadataItem("DMD_CREATIONOPTIONLIST") or ""
+    return [c for c in OUTPUT_COMPRESSIONS if c == "NONE" or f"<Value>{c}</Value>" in option_list]
+
+def work_tiff_options(integer=False):
+    """
+    中間ファイルの作成オプション。速いZSTDが使えなければDEFLATEにする。
+    PREDICTOR=3 は浮動小数点専用なので、整数 (integer=True) のファイルには水平差分 (PREDICTOR=2) を使う
+    """
+    compress = "ZSTD" if "ZSTD" in supported_compressions() else "DEFLATE"
+    return [f"COMPRESS={compress}", f"PREDICTOR={2 if integer else 3}", "TILED=YES", "BIGTIFF=IF_SAFER"]
+
+def resolve_output_options(options, width, height, feedback):
+    """
+    出力形式の指定を、出力の大きさとGDALの対応状況に合わせて確定する。
+    layout="auto" は大きなDEMだけCOGにし、使えない圧縮方式はDEFLATEに戻す。
+    """
+    opts = dict(DEFAULT_OUTPUT_OPTIONS, **(options or {}))
+    opts["compress"] = str(opts["compress"]).upper()
+    if opts["layout"] not in OUTPUT_LAYOUTS:
+        raise PngTile2DemError(f"不明な出力形式です: {opts['layout']} ({' / '.join(OUTPUT_LAYOUTS)})")
+    if opts["compress"] not in OUTPUT_COMPRESSIONS:
+        raise PngTile2DemError(f"不明な圧縮方式です: {opts['compress']} ({' / '.join(OUTPUT_COMPRESSIONS)})")
+
+    if opts["compress"] not in supported_compressions():
+        feedback.reportError(f"このGDALでは {opts['compress']} 圧縮が使えないため、DEFLATEで保存します。", fatalError=False)
+        opts["compress"] = "DEFLATE"
+    if opts["layout"] == "auto":
+        opts["layout"] = "cog" if width * height >= COG_MIN_PIXELS else "gtiff"
+    if opts["layout"] == "cog" and gdal.GetDriverByName("COG") is None:
+        feedback.reportError("このGDALはCOG出力に対応していないため、タイル化GeoTIFFで保存します。", fatalError=False)
+        opts["layout"] = "gtiff"
+    return opts
+
+def output_creation_options(opts):
+    """確定した出力形式のGDAL作成オプション (GTiff / COG)"""
+    cog = opts["layout"] == "cog"
+    compress = opts["compress"]
+    options = [f"COMPRESS={compress}", "NUM_THREADS=ALL_CPUS", "BIGTIFF=IF_SAFER"]
+    if compress in ("DEFLATE", "ZSTD"):
+        # 浮動小数点は差分予測 (3)、センチメートルの整数は水平差分 (2) で圧縮率が上がる
+        options.append("PREDICTOR=YES" if cog else f"PREDICTOR={2 if opts['int_cm'] else 3}")
+    if compress.startswith("LERC"):
+        # 整数で保存する場合、許容誤差もセンチメートル単位になる
+        max_z_error = opts["max_z_error"] * (100 if opts["int_cm"] else 1)
+        options.append(f"MAX_Z_ERROR={max_z_error}")
+    if cog:
+        options += ["BLOCKSIZE=512", "OVERVIEWS=AUTO", "RESAMPLING=AVERAGE"]
+    else:
+        options.append("TILED=YES")
+    return options
+
+def needs_finalize(opts):
+    """Warp・分割処理の結果を、そのまま出力にできずに変換が必要か"""
+    return opts["layout"] == "cog" or opts["int_cm"]
+
+def convert_to_int_cm(src_path, dst_path, nodata, creation_options, rows=512):
+    """浮動小数点 (m) のGeoTIFFを、センチメートル単位のInt32 (スケール0.01) に行単位で変換する"""
+    src_ds = gdal.Open(src_path)
+    src_band = src_ds.GetRasterBand(1)
+    width, height = src_ds.RasterXSize, src_ds.RasterYSize
+    int_nodata = int(round(nodata * 100))
+    dst_ds = gdal.GetDriverByName("GTiff").Create(dst_path, width, height, 1, gdal.GDT_Int32, options=creation_options)
+    dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
+    dst_ds.SetProjection(src_ds.GetProjection())
+    dst_band = dst_ds.GetRasterBand(1)
+    dst_band.SetNoDataValue(int_nodata)
+    dst_band.SetScale(0.01)
+    dst_band.SetOffset(0.0)
+    for y in range(0, height, rows):
+        h = min(rows, height - y)
+        arr = src_band.ReadAsArray(0, y, width, h)
+        invalid = np.isnan(arr) | (arr == nodata)
+        dst_band.WriteArray(np.where(invalid, int_nodata, np.rint(arr * 100.0)).astype(np.int32), 0, y)
+    dst_band = None
+    dst_ds = None
+    src_ds = None
+
+def finalize_output(work_path, output_tif, opts, nodata, tmpdir):
+    """中間ファイル (浮動小数点のGeoTIFF) から、指定の形式で出力を書き出す"""
+    with run_stats.timer("finalize"):
+        src_path = work_path
+        if opts["int_cm"]:
+            # COGはCreateCopyでしか作れないので、整数化したものを一度中間ファイルにする
+            src_path = output_tif if opts["layout"] == "gtiff" else os.path.join(tmpdir, "int_cm.tif")
+            convert_to_int_cm(work_path, src_path, nodata,
+                              output_creation_options(opts) if src_path == output_tif else work_tiff_options(integer=True))
+        if src_path != output_tif:
+            driver = "COG" if opts["layout"] == "cog" else "GTiff"
+            gdal.Translate(output_tif, src_path, options=gdal.TranslateOptions(
+                format=driver, creationOptions=output_creation_options(opts)))
+
+def run_mosaic(executor, tx_start, ty_start, tx_end, ty_end, BASE_Z, primary_key,
+               output_tif, out_wkt, out_bounds, tmpdir, nodata, stats, feedback, sources, checkpoint=None,
+               output_options=None):
+    """全タイルを1枚のモザイクに合成してから、まとめてWarpする (キャンセルされた場合はWarpせずFalseを返す)"""
+    n_tiles = (tx_end - tx_start + 1) * (ty_end - ty_start + 1)
+
+    # 合成結果は1枚のタイル化GeoTIFF (EPSG:3857) にブロック単位で直接書き込む
+    # (作業フォルダがあればそこに置き、再開時は書き込み済みのモザイクを開き直す)
+    mosaic_path = checkpoint.path(MOSAIC_FILE) if checkpoint else os.path.join(tmpdir, "mosaic.tif")
+    if checkpoint and checkpoint.resumed and os.path.exists(mosaic_path):
+        mosaic_ds = gdal.Open(mosaic_path, gdal.GA_Update)
+        for written, high_res_missing in checkpoint.done_tiles.values():
+            stats["written"] += int(written)
+            stats["missing_highres"] += int(high_res_missing)
+            stats["completed"] += 1
+    else:
+        if checkpoint: checkpoint.discard_progress()
+        mosaic_ds = create_mosaic_dataset(mosaic_path, tx_start, ty_start, tx_end, ty_end, BASE_Z, nodata)
+    mosaic_band = mosaic_ds.GetRasterBand(1)
+
+    # 親タイルを共有する子タイルが続けて処理されるよう、ヒルベルト曲線の順に並べる
+    done = checkpoint.done_tiles if checkpoint else {}
+    tiles = [(x, y) for y in range(ty_start, ty_end + 1) for x in range(tx_start, tx_end + 1) if (x, y) not in done]
+    tasks = [(x, y, BASE_Z, primary_key, sources, nodata) for x, y in spatial_order(tiles, BASE_Z)]
+
+    def on_result(bx, by, dem, high_res_missing):
+        if dem is not None:
+            # GDALのデータセットはスレッドセーフではないので、書き込みはこのスレッドだけで行う
+            with run_stats.timer("tile_write"):
+                mosaic_band.WriteArray(dem, (bx - tx_start) * 256, (by - ty_start) * 256)
+            stats["written"] += 1
+        if high_res_missing: stats["missing_highres"] += 1  # ★追加: 欠損があればカウントアップ
+        stats["completed"] += 1
+        feedback.setProgress(int(stats["completed"] / n_tiles * 80))
+        if checkpoint:
+            checkpoint.add_tile(bx, by, dem is not None, high_res_missing)
+            if checkpoint.should_commit():
+                # モザイクをディスクに反映してから完了を記録する
+                mosaic_ds.FlushCache()
+                checkpoint.commit()
+
+    try:
+        finished = composite_tiles(executor, tasks, feedback, on_result)
+    finally:
+        if checkpoint:
+            mosaic_ds.FlushCache()
+            checkpoint.commit()
+    mosaic_band = None
+    mosaic_ds = None
+    # キャンセル時は途中までのモザイクを出力しない (作業フォルダがあれば次回そこから再開できる)
+    if not finished: return False
+    if stats["written"] == 0: return True
+
+    # Warp
+    feedback.pushInfo("Reprojecting...")
+
+    # ★追加: 出力CRSにおける自動計算された解像度を取得し、正方形(cellsize)に強制する
+    src_ds = gdal.Open(mosaic_path)
+    target_res = suggest_resolution(src_ds, out_wkt)
+    src_ds = None
+
+    # 出力形式 (COGや整数化が必要なら、一度中間ファイルにWarpしてから変換する)
+    opts = resolve_output_options(output_options, (out_bounds[2] - out_bounds[0]) / target_res,
+                                  (out_bounds[3] - out_bounds[1]) / target_res, feedback)
+    warp_path = os.path.join(tmpdir, "warped.tif") if needs_finalize(opts) else output_tif
+
+    warp_opts = gdal.WarpOptions(
+        dstSRS=out_wkt,
+        format="GTiff",
+        resampleAlg=gdal.GRA_Bilinear,
+        dstNodata=nodata,
+        # ★追加: 出力範囲をユーザー指定範囲(minX, minY, maxX, maxY)に固定
+        outputBounds=out_bounds,
+        xRes=target_res,           # ★追加: 強制的に正方形にする
+        yRes=target_res,           # ★追加: 強制的に正方形にする
+        targetAlignedPixels=True,  # ★追加: 元のグリッド境界に合わせて出力範囲を自動拡張（スナップ）する
+        creationOptions=work_tiff_options() if warp_path != output_tif else output_creation_options(opts)
+    )
+    with run_stats.timer("warp"):
+        gdal.Warp(warp_path, mosaic_path, options=warp_opts)
+    if warp_path != output_tif:
+        finalize_output(warp_path, output_tif, opts, nodata, tmpdir)
+    return True
+
+def run_chunked(executor, tx_start, ty_start, tx_end, ty_end, BASE_Z, primary_key,
+                output_tif, out_wkt, out_bounds, tmpdir, nodata, stats, feedback, sources, checkpoint=None,
+                output_options=None):
+    """
+    出力グリッドをウィンドウに分割し、ウィンドウごとに取得・合成・Warpして書き出す。
+    合成済みタイルは、それを必要とするウィンドウがなくなった時点で解放する。
+    メモリに残るのは処理中のウィンドウのタイルと、次の列 (行) のウィンドウと共有する境界のタイルで、
+    後者は出力の短辺に比例する。キャンセルされた場合はFalseを返す。
+    """
+    out_srs = osr.SpatialReference(); out_srs.ImportFromWkt(out_wkt)
+    out_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    # 出力グリッド (全体のWarpと同じく、推奨解像度の正方形画素で範囲をスナップする)
+    footprint = create_mosaic_dataset("", tx_start, ty_start, tx_end, ty_end, BASE_Z, nodata, driver_name="VRT")
+    res = suggest_resolution(footprint, out_wkt)
+    footprint = None
+    xmin = math.floor(out_bounds[0] / res) * res
+    ymin = math.floor(out_bounds[1] / res) * res
+    xmax = math.ceil(out_bounds[2] / res) * res
+    ymax = math.ceil(out_bounds[3] / res) * res
+    width, height = int(round((xmax - xmin) / res)), int(round((ymax - ymin) / res))
+
+    # 作業フォルダがあればそこへ書き出し (再開時は開き直す)、最後に出力先へ指定の形式で書き出す。
+    # COGや整数化が必要な場合も、いったん中間ファイルに書いてから変換する
+    opts = resolve_output_options(output_options, width, height, feedback)
+    if checkpoint:
+        out_path = checkpoint.path(CHUNKED_FILE)
+    elif needs_finalize(opts):
+        out_path = os.path.join(tmpdir, CHUNKED_FILE)
+    else:
+        out_path = output_tif
+    if checkpoint and checkpoint.resumed and os.path.exists(out_path):
+        out_ds = gdal.Open(out_path, gdal.GA_Update)
+        for written, missing_highres in checkpoint.done_windows.values():
+            stats["written"] += written
+            stats["missing_highres"] += missing_highres
+    else:
+        if checkpoint: checkpoint.discard_progress()
+        out_ds = gdal.GetDriverByName("GTiff").Create(
+            out_path, width, height, 1, gdal.GDT_Float32,
+            options=output_creation_options(opts) if out_path == output_tif else work_tiff_options()
+        )
+        out_ds.SetGeoTransform((xmin, res, 0, ymax, 0, -res))
+        out_ds.SetProjection(out_wkt)
+    out_band = out_ds.GetRasterBand(1)
+    out_band.SetNoDataValue(nodata)
+    done_windows = checkpoint.done_windows if checkpoint else {}
+
+    # 各ウィンドウが必要とするタイル範囲 (バイリニア用に1タイル広げ、全体のタイル範囲に収める)
+    ct = osr.CoordinateTransformation(out_srs, MERCATOR_SRS)
+    windows = []
+    for wy in range(0, height, WINDOW_SIZE):
+        for wx in range(0, width, WINDOW_SIZE):
+            ww, wh = min(WINDOW_SIZE, width - wx), min(WINDOW_SIZE, height - wy)
+            bounds = (xmin + wx * res, ymax - (wy + wh) * res, xmin + (wx + ww) * res, ymax - wy * res)
+            t0x, t0y, t1x, t1y = mercator_bounds_to_tiles(transform_bounds(ct, bounds), BASE_Z)
+            rect = (max(tx_start, t0x - 1), max(ty_start, t0y - 1), min(tx_end, t1x + 1), min(ty_end, t1y + 1))
+            windows.append((wx, wy, ww, wh, bounds, rect))
+
+    # タイルごとの参照数 (残りいくつのウィンドウがそのタイルを使うか)
+    refs = np.zeros((ty_end - ty_start + 1, tx_end - tx_start + 1), dtype=np.int32)
+    for i, (*_, (r0x, r0y, r1x, r1y)) in enumerate(windows):
+        if r0x <= r1x and r0y <= r1y and i not in done_windows:
+            refs[r0y - ty_start:r1y - ty_start + 1, r0x - tx_start:r1x - tx_start + 1] += 1
+
+    # ウィンドウの境界のタイルは隣のウィンドウと共有するので、次の列 (行) のウィンドウで使われるまで残る。
+    # その量が出力の短辺に比例するよう、横長の出力は列ごと (縦方向) に処理する。
+    # (ウィンドウの番号は作業フォルダの記録に使うので、並びはそのままで処理する順番だけを変える)
+    n_cols = -(-width // WINDOW_SIZE)
+    n_rows = -(-height // WINDOW_SIZE)
+    order = list(range(len(windows)))
+    if n_cols > n_rows:
+        order.sort(key=lambda i: (windows[i][0], windows[i][1]))
+
+    done_tiles = {}  # (bx, by) -> 合成済み配列 (全面NoDataならNone)
+    finished = True
+
+    def on_result(bx, by, dem, high_res_missing):
+        done_tiles[(bx, by)] = dem
+        if dem is not None: stats["written"] += 1
+        if high_res_missing: stats["missing_highres"] += 1
+        stats["completed"] += 1
+
+    for n, i in enumerate(order):
+        wx, wy, ww, wh, bounds, (r0x, r0y, r1x, r1y) = windows[i]
+        if r0x > r1x or r0y > r1y or i in done_windows:
+            continue
+        written_before, missing_before = stats["written"], stats["missing_highres"]
+        tiles = [(x, y) for y in range(r0y, r1y + 1) for x in range(r0x, r1x + 1) if (x, y) not in done_tiles]
+        tasks = [(x, y, BASE_Z, primary_key, sources, nodata) for x, y in spatial_order(tiles, BASE_Z)]
+        if not composite_tiles(executor, tasks, feedback, on_result):
+            finished = False
+            break
+
+        # ウィンドウ分のタイルだけをメモリ上でモザイクし、出力の該当範囲へWarpする
+        t0 = time.perf_counter()
+        src_ds = create_mosaic_dataset("", r0x, r0y, r1x, r1y, BASE_Z, nodata, driver_name="MEM")
+        src_band = src_ds.GetRasterBand(1)
+        has_data = False
+        for x in range(r0x, r1x + 1):
+            for y in range(r0y, r1y + 1):
+                dem = done_tiles.get((x, y))
+                if dem is not None:
+                    src_band.WriteArray(dem, (x - r0x) * 256, (y - r0y) * 256)
+                    has_data = True
+        run_stats.add_time("mosaic", time.perf_counter() - t0)
+
+        if has_data:
+            dst_ds = gdal.GetDriverByName("MEM").Create("", ww, wh, 1, gdal.GDT_Float32)
+            dst_ds.SetGeoTransform((bounds[0], res, 0, bounds[3], 0, -res))
+            dst_ds.SetProjection(out_wkt)
+            dst_ds.GetRasterBand(1).SetNoDataValue(nodata)
+            dst_ds.GetRasterBand(1).Fill(nodata)
+            with run_stats.timer("warp"):
+                gdal.Warp(dst_ds, src_ds, options=gdal.WarpOptions(
+                    resampleAlg=gdal.GRA_Bilinear, srcNodata=nodata, dstNodata=nodata))
+            with run_stats.timer("tile_write"):
+                out_band.WriteArray(dst_ds.GetRasterBand(1).ReadAsArray(), wx, wy)
+            dst_ds = None
+        else:
+            with run_stats.timer("tile_write"):
+                out_band.WriteArray(np.full((wh, ww), nodata, dtype=np.float32), wx, wy)
+        src_band = None
+        src_ds = None
+
+        # もうどのウィンドウからも使われないタイルを解放する
+        refs[r0y - ty_start:r1y - ty_start + 1, r0x - tx_start:r1x - tx_start + 1] -= 1
+        for x in range(r0x, r1x + 1):
+            for y in range(r0y, r1y + 1):
+                if refs[y - ty_start, x - tx_start] <= 0:
+                    done_tiles.pop((x, y), None)
+
+        if checkpoint:
+            # ウィンドウの書き込みをディスクに反映してから完了を記録する
+            out_ds.FlushCache()
+            checkpoint.add_window(i, stats["written"] - written_before, stats["missing_highres"] - missing_before)
+            checkpoint.commit()
+
+        feedback.setProgress(int((n + 1) / len(windows) * 100))
+
+    out_band = None
+    out_ds = None
+    if not finished:
+        # 出力先へ直接書いていた場合は、途中までのファイルを残さない
+        # (作業フォルダの中間ファイルは再開に使うので残す)
+        if out_path == output_tif:
+            try:
+                gdal.GetDriverByName("GTiff").Delete(out_path)
+            except RuntimeError:
+                pass
+        return False
+    if out_path != output_tif:
+        finalize_output(out_path, output_tif, opts, nodata, tmpdir)
+    return True
+
+# ==============================================================================
+# ジョブ全体の実行 (QGIS / コマンドライン共通)
+# ==============================================================================
+
+def make_srs(crs):
+    """"EPSG:6677" などの文字列やWKTから、経度・緯度の順で扱う SpatialReference を作る"""
+    srs = osr.SpatialReference()
+    try:
+        srs.SetFromUserInput(crs)
+    except RuntimeError:
+        raise PngTile2DemError(f"座標参照系を解釈できません: {crs}")
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+def extent_to_job_bounds(extent, extent_crs, output_crs):
+    """
+    範囲 (minx, miny, maxx, maxy) を、タイル計算用の経緯度範囲と出力CRSでの切り取り範囲に変換する。
+    経緯度は四隅のみ (QGIS版と同じ)、出力範囲は外周を細かく変換した外接矩形。
+    """
+    src_srs = make_srs(extent_crs)
+    ct_4326 = osr.CoordinateTransformation(src_srs, make_srs("EPSG:4326"))
+    minx, miny, maxx, maxy = extent
+    lon0, lat0, _ = ct_4326.TransformPoint(minx, miny)
+    lon1, lat1, _ = ct_4326.TransformPoint(maxx, maxy)
+    lonlat_bounds = (lon0, lat0, lon1, lat1)
+    out_bounds = transform_bounds(osr.CoordinateTransformation(src_srs, make_srs(output_crs)), extent)
+    return lonlat_bounds, out_bounds
+
+def find_source(key, sources=TILE_SOURCES):
+    """キーからソース定義を探す"""
+    for s in sources:
+        if s["key"] == key:
+            return s
+    raise PngTile2DemError(f"不明なDEMソースです: {key}")
+
+def write_run_report(report_path, job_dir, feedback, **extra):
+    """計測結果をJSONで保存する (失敗しても処理結果には影響させない)"""
+    paths = [p for p in (report_path, os.path.join(job_dir, "report.json") if job_dir else None) if p]
+    for path in paths:
+        try:
+            run_stats.write_json(path, **extra)
+        except OSError as e:
+            feedback.reportError(f"計測レポートを保存できませんでした ({path}: {e})", fatalError=False)
+
+
+def run_job(lonlat_bounds, out_bounds, primary_key, output_crs, output_tif, feedback=None,
+            cache_dir=DEFAULT_CACHE_DIR, cache_bytes=DEFAULT_CACHE_BYTES, job_dir=None,
+            nodata=-9999.0, sources=TILE_SOURCES, processes=0, report_path=None, output_options=None,
+            memory_bytes=DEFAULT_MEMORY_BYTES):
+    """
+    DEMを作成して output_tif に書き出す。
+    lonlat_bounds: タイル計算用の経緯度範囲 / out_bounds: 出力CRSでの切り取り範囲
+    output_crs: "EPSG:6677" などの文字列またはWKT / cache_bytes: 0でタイルキャッシュ無効
+    job_dir: 指定すると中断後に同じ条件で続きから再開できる
+    processes: 1以上ならデコード・合成をその数のワーカープロセスで行う (取得は親プロセスのスレッド)
+    report_path: 段階ごとの時間や通信量をまとめたJSONレポートの保存先 (job_dir があれば report.json にも保存する)
+    output_options: 出力形式 {"layout", "compress", "max_z_error", "int_cm"} (省略した項目は DEFAULT_OUTPUT_OPTIONS)
+    memory_bytes: 実行中にメモリに保持するデコード済みタイルの上限 (プロセス並列時はワーカーで等分する)
+    """
+    global disk_cache, io_executor, decode_processes
+    if feedback is None:
+        feedback = ConsoleFeedback()
+    configure_memory_cache(memory_bytes)
+    with coverage_lock:
+        coverage_index.clear()
+        coverage_stats["skipped"] = 0
+    with prefetch_lock:
+        prefetch_cache.clear()
+    run_stats.reset()
+
+    primary_source = find_source(primary_key, sources)
+    out_wkt = make_srs(output_crs).ExportToWkt()
+
+    disk_cache = None
+    if cache_bytes > 0:
+        try:
+            disk_cache = DiskTileCache(cache_dir, cache_bytes)
+        except Exception as e:
+            feedback.reportError(f"タイルキャッシュを開けませんでした ({e})。キャッシュなしで続行します。", fatalError=False)
+
+    BASE_Z = primary_source["zoom"]
+    tx_start, ty_start, tx_end, ty_end = tile_range_for_lonlat(lonlat_bounds, BASE_Z)
+    n_tiles = (tx_end - tx_start + 1) * (ty_end - ty_start + 1)
+
+    # ==========================================================
+    # ★ 推定時間の計算と表示
+    # (ソースごとのリクエスト数からキャッシュ済みの分を引き、過去の実行で測った処理量で見積もる)
+    # ==========================================================
+    plan = plan_requests((tx_start, ty_start, tx_end, ty_end), BASE_Z, primary_key, sources, disk_cache)
+    n_requests, n_cached = summarize(plan)
+    feedback.pushInfo(f"--- 処理見積もり ---")
+    feedback.pushInfo(f"総タイル数 (Zoom {BASE_Z}): {n_tiles} 枚")
+    feedback.pushInfo(f"最大リクエスト数: {n_requests} 件 (うちキャッシュ済み {n_cached} 件)")
+    feedback.pushInfo(f"推定処理時間: 約 {format_duration(estimate_seconds(plan, primary_key, n_tiles, load_history(cache_dir), sources))}")
+    feedback.pushInfo(f"※通信速度やPC性能により前後します。")
+    feedback.pushInfo(f"--------------------")
+
+    tmpdir = tempfile.mkdtemp(prefix="pngtile_composite_")
+
+    # 作業フォルダが指定されていれば、同じ条件の前回の続きから処理する
+    checkpoint = None
+    if job_dir:
+        checkpoint = JobCheckpoint(job_dir, {
+            "primary_key": primary_key, "base_z": BASE_Z,
+            "tile_range": [tx_start, ty_start, tx_end, ty_end],
+            "output_crs": out_wkt, "out_bounds": list(out_bounds),
+            "nodata": nodata, "chunked": n_tiles > MOSAIC_MAX_TILES,
+        })
+        if checkpoint.resumed:
+            feedback.pushInfo(f"前回のジョブを再開します (完了済み: タイル {len(checkpoint.done_tiles)} 枚 / ウィンドウ {len(checkpoint.done_windows)} 個)")
+
+    status = "failed"
+    stats = {"written": 0, "completed": 0, "missing_highres": 0}
+    try:
+        # 待ち時間の大半は通信なので、CPU数より多めのスレッドで同時にリクエストを出す
+        max_workers = min(32, (os.cpu_count() or 4) * 4)
+
+        if processes > 0:
+            blocker = process_mode_blocker(primary_key, sources)
+            if blocker:
+                feedback.reportError(f"{blocker}。スレッドのみで処理します。", fatalError=False)
+                processes = 0
+        if processes > 0:
+            # 取得 (親プロセスのスレッド) とデコード・合成 (ワーカープロセス) に分ける。
+            # ホストごとの上限は親と全ワーカーの合計で守るよう、親と子で半分ずつ分け合う
+            python_exe = worker_python_executable()
+            if python_exe is None:
+                raise PngTile2DemError("ワーカープロセスを起動するPythonが見つかりません。"
+                                       "デコード・合成のプロセス数を0 (スレッドのみ) にして実行してください。")
+            mp_context = multiprocessing.get_context("spawn")
+            # spawnは既定で sys.executable を起動するため、QGIS上ではQGIS本体が起動してしまう
+            # (multiprocessing全体の設定になるが、同じPythonを指すだけなので他の利用には影響しない)
+            mp_context.set_executable(python_exe)
+            set_rate_share(0.5)
+            open_session(max_connections_per_host=max_workers)
+            feedback.pushInfo(f"デコード・合成を {processes} 個のプロセスで並列に行います。")
+            executor = ProcessPoolExecutor(
+                max_workers=processes, mp_context=mp_context,
+                initializer=init_decode_worker,
+                initargs=(cache_dir, cache_bytes if disk_cache is not None else 0, 0.5 / processes, 4,
+                          memory_bytes // processes)
+            )
+            io_executor = ThreadPoolExecutor(max_workers=max_workers)
+            decode_processes = processes
+        else:
+            set_rate_share(1.0)
+            open_session(max_connections_per_host=max_workers)
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        with executor:
+            if n_tiles <= MOSAIC_MAX_TILES:
+                finished = run_mosaic(executor, tx_start, ty_start, tx_end, ty_end, BASE_Z, primary_key,
+                           output_tif, out_wkt, out_bounds, tmpdir, nodata, stats, feedback, sources, checkpoint,
+                           output_options)
+            else:
+                feedback.pushInfo(f"タイル数が {MOSAIC_MAX_TILES} 枚を超えるため、出力を分割して順に処理します。")
+                finished = run_chunked(executor, tx_start, ty_start, tx_end, ty_end, BASE_Z, primary_key,
+                            output_tif, out_wkt, out_bounds, tmpdir, nodata, stats, feedback, sources, checkpoint,
+                            output_options)
+
+        if not finished:
+            # キャンセル時は出力・集計を行わず、レポートにはキャンセルとして記録する
+            status = "canceled"
+            feedback.pushInfo("処理がキャンセルされました。出力は作成していません。")
+            return stats
+        if stats["written"] == 0: raise PngTile2DemError("No tiles were downloaded.")
+
+        if coverage_stats["skipped"] > 0:
+            feedback.pushInfo(f"カバレッジ索引により提供範囲外のリクエストを {coverage_stats['skipped']} 件省略しました。")
+        if disk_cache is not None:
+            feedback.pushInfo(f"タイルキャッシュ: ヒット {disk_cache.hits} 件 / ミス {disk_cache.misses} 件 / 既知の欠損タイル {disk_cache.negative_hits} 件 ({cache_dir})")
+        if tile_cache.evictions or parent_cache.evictions:
+            feedback.pushInfo(f"メモリ上のタイル: 最大 {(tile_cache.peak_bytes + parent_cache.peak_bytes) / 1024 ** 2:.0f} MB、"
+                              f"上限 ({memory_bytes / 1024 ** 2:.0f} MB) を超えたため {tile_cache.evictions + parent_cache.evictions} 件を破棄しました")
+
+        # ★追加: 高解像度データが取得できなかったタイルがある場合、ログにお知らせを出す
+        missing_highres_count = stats["missing_highres"]
+        if missing_highres_count > 0:
+            feedback.reportError(f"【お知らせ】{missing_highres_count}個の区画で指定の高解像度DEM（1m等）が取得できず、5mDEM等の粗いデータで補完されたか、データなしとなりました。サーバーへのアクセス集中や提供範囲外の可能性があります。", fatalError=False)
+
+        for line in run_stats.summary_lines():
+            feedback.pushInfo(line)
+        # 次回以降の見積もりのため、ホストごとの処理量などを記録する。全タイルをこの実行で処理し終えた場合だけ記録し、
+        # キャンセル・再開した実行は除く (一部しか処理していないのに全体の予定と比べると、見積もりが小さく偏る)
+        if finished and not (checkpoint and checkpoint.resumed):
+            record_run(cache_dir, run_stats.snapshot(), plan, n_tiles)
+        status = "completed"
+        return stats
+
+    finally:
+        if feedback.isCanceled() and status != "completed":
+            status = "canceled"
+        write_run_report(report_path, job_dir, feedback, status=status, output=output_tif, primary=primary_key,
+                         zoom=BASE_Z, tiles=n_tiles, processes=processes, stats=dict(stats),
+                         coverage_skipped=coverage_stats["skipped"],
+                         cache=None if disk_cache is None else {"hits": disk_cache.hits, "misses": disk_cache.misses,
+                                                                "negative_hits": disk_cache.negative_hits},
+                         memory_cache={"max_bytes": memory_bytes,
+                                       "peak_bytes": tile_cache.peak_bytes + parent_cache.peak_bytes,
+                                       "evictions": tile_cache.evictions + parent_cache.evictions})
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if io_executor is not None:
+            io_executor.shutdown()
+            io_executor = None
+            decode_processes = 0
+        close_session()
+        if checkpoint is not None:
+            checkpoint.close()
+        if disk_cache is not None:
+            disk_cache.evict()
+            disk_cache.close()
+            disk_cache = None
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+標高タイル (RGBA画像) から標高値へのデコード
+複数タイルを (N, 高さ, 幅, 4) の配列にまとめ、RGBAの4バイトを1つのuint32として読むことで
+3形式 (国土地理院 / Q地図 / 産総研) の計算式とNoData判定を1回の走査で行う。
+
+画像の読み込みはバックエンドを切り替えられる (GDAL / QImage)。
+どちらも入っていなくても、RGBA配列のデコード (decode_rgba_batch) はnumpyのみで動く。
+"""
+
+import os
+import threading
+import numpy as np
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+try:
+    from qgis.PyQt.QtGui import QImage
+    from qgis.PyQt.QtCore import Qt
+    try:
+        # QGIS 4.0 (PyQt6) 用
+        QIMAGE_RGBA8888 = QImage.Format.Format_RGBA8888
+        QIMAGE_SCALE_ARGS = (Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    except AttributeError:
+        # QGIS 3.x (PyQt5) 用
+        QIMAGE_RGBA8888 = QImage.Format_RGBA8888
+        QIMAGE_SCALE_ARGS = (Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+except ImportError:
+    QImage = None
+
+# 画像の読み込みに使うバックエンド
+# "auto": GDALで読み、GDALで読めない画像 (WEBPドライバがない場合など) だけQImageで読む
+# "gdal": GDALのみ (Qt不要。ワーカースレッド・プロセスでも安全) / "qimage": QImageのみ
+IMAGE_BACKENDS = ("auto", "gdal", "qimage")
+IMAGE_BACKEND = os.environ.get("PNGTILE2DEM_IMAGE_BACKEND", "auto")
+
+NODATA_X = 1 << 23   # 国土地理院・Q地図形式のNoData (128, 0, 0)
+SCALE_F32 = np.float32(0.01)
+BLOCK_PIXELS = 1 << 17  # 一度に処理する画素数 (一時配列がCPUキャッシュに収まる程度に分割する)
+
+# ソースの形式
+FORMAT_GSI = "gsi"    # 国土地理院形式: 24bitの2の補数 x 0.01m / (128,0,0)・黒・透明がNoData
+FORMAT_QMAP = "qmap"  # Q地図形式: 符号なし24bit x 0.01m / (128,0,0)・黒・透明がNoData
+FORMAT_GSJ = "gsj"    # 産総研形式: 符号なし24bit x 0.01m / 透明のみがNoData
+
+
+def tile_format(source):
+    """ソース定義からデコード形式を決める"""
+    if source["key"] == "qmap": return FORMAT_QMAP
+    elif source["xy_order"] == "yx": return FORMAT_GSJ
+    else: return FORMAT_GSI
+
+
+def decode_rgba_batch(rgba, fmt, out=None):
+    """
+    (N, 高さ, 幅, 4) または (高さ, 幅, 4) のRGBA配列 (uint8) を標高 (float32, NoDataはNaN) にデコードする。
+    out: 結果を書き込むC連続の float32 配列 (省略時は新しく作る)
+    """
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    if rgba.shape[-1] == 3:
+        # アルファのない画像は全面不透明として扱う
+        rgba = np.concatenate([rgba, np.full(rgba.shape[:-1] + (1,), 255, dtype=np.uint8)], axis=-1)
+    elif rgba.shape[-1] != 4:
+        raise ValueError("RGB/RGBA の配列を渡してください")
+    if out is None:
+        out = np.empty(rgba.shape[:-1], dtype=np.float32)
+    elif out.shape != rgba.shape[:-1] or out.dtype != np.float32 or not out.flags.c_contiguous:
+        raise ValueError("out には入力と同じ形のC連続なfloat32配列を渡してください")
+
+    # ビッグエンディアンのuint32として読むと R<<24 | G<<16 | B<<8 | A になる
+    packed = rgba.view(">u4").reshape(-1)
+    flat = out.reshape(-1)
+    for start in range(0, packed.size, BLOCK_PIXELS):
+        block = slice(start, start + BLOCK_PIXELS)
+        _decode_packed(packed[block], fmt, flat[block])
+    return out
+
+
+def _decode_packed(packed, fmt, out):
+    if fmt == FORMAT_GSI:
+        # 下位8bit(A)を落としてint32として右シフトすると、24bitの値が符号拡張される
+        value = (packed & np.uint32(0xFFFFFF00)).astype(np.int32) >> 8
+        # 元の実装と同じく倍精度で0.01倍してからfloat32に丸める
+        np.multiply(value, 0.01, out=out, casting="unsafe")
+        nodata = value == 0
+        nodata |= value == -NODATA_X
+    else:
+        value = packed >> np.uint32(8)
+        # 24bitまではfloat32で正確に表せるので、元の実装と同じくfloat32のまま0.01倍する
+        np.multiply(value, SCALE_F32, out=out, dtype=np.float32, casting="unsafe")
+        if fmt == FORMAT_QMAP:
+            nodata = value == 0
+            nodata |= value == NODATA_X
+        else:
+            nodata = None
+
+    # 透明な画素 (A=0) はどの形式でもNoData
+    transparent = (packed & np.uint32(0xFF)) == 0
+    if nodata is None:
+        nodata = transparent
+    else:
+        nodata |= transparent
+    np.copyto(out, np.float32(np.nan), where=nodata)
+
+
+def decode_gsi_png(img_arr):
+    """国土地理院形式のデコード"""
+    return decode_rgba_batch(img_arr, FORMAT_GSI)
+
+def decode_qmap_rgb(img_arr):
+    """Q地図形式のデコード"""
+    return decode_rgba_batch(img_arr, FORMAT_QMAP)
+
+def decode_gsj_png(img_arr):
+    """産総研形式のデコード (AlphaチャンネルによるNoData)"""
+    return decode_rgba_batch(img_arr, FORMAT_GSJ)
+
+
+# ==============================================================================
+# 画像の読み込み (バックエンド)
+# ==============================================================================
+
+def available_backends():
+    """このPython環境で使える画像バックエンド"""
+    names = ["auto"]
+    if gdal is not None: names.append("gdal")
+    if QImage is not None: names.append("qimage")
+    return names
+
+def set_image_backend(name):
+    """画像バックエンドを切り替える ("auto" / "gdal" / "qimage")"""
+    global IMAGE_BACKEND
+    if name not in IMAGE_BACKENDS:
+        raise ValueError(f"不明な画像バックエンドです: {name}")
+    if name != "auto" and name not in available_backends():
+        raise ValueError(f"画像バックエンド {name} はこの環境では使えません")
+    IMAGE_BACKEND = name
+
+_scratch = threading.local()
+
+def _scratch_rgba(height, width):
+    """スレッドごとに使い回すRGBAの読み込み先 (デコード結果は別の配列なので上書きしてよい)"""
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buf = buffers.get((height, width))
+    if buf is None:
+        buf = buffers[(height, width)] = np.empty((height, width, 4), dtype=np.uint8)
+    return buf
+
+def decode_with_gdal(content, fmt, keep_512=False):
+    """GDALのPNG/WEBPドライバで読み込み、確保済みのRGBAバッファへ直接展開してデコードする"""
+    path = f"/vsimem/pngtile2dem_{threading.get_ident()}"
+    gdal.FileFromMemBuffer(path, content)
+    try:
+        try:
+            ds = gdal.Open(path)
+        except RuntimeError:
+            return None
+        if ds is None:
+            return None
+        width, height = ds.RasterXSize, ds.RasterYSize
+        if keep_512 and width == 512 and height == 512:
+            out_w, out_h = width, height
+        else:
+            out_w, out_h = 256, 256
+        n_bands = ds.RasterCount
+        bands = [ds.GetRasterBand(i + 1) for i in range(n_bands)]
+        color_table = bands[0].GetColorTable() if n_bands == 1 else None
+        # パレット形式はインデックスなので最近傍で、それ以外はQImageと同様に滑らかに縮尺をそろえる
+        alg = gdal.GRIORA_NearestNeighbour if color_table is not None else gdal.GRIORA_Bilinear
+
+        rgba = _scratch_rgba(out_h, out_w)
+        if color_table is not None:
+            # パレット形式のPNGは色表で展開する
+            lut = np.zeros((256, 4), dtype=np.uint8)
+            for i in range(min(256, color_table.GetCount())):
+                lut[i] = color_table.GetColorEntry(i)
+            np.take(lut, bands[0].ReadAsArray(buf_xsize=out_w, buf_ysize=out_h, resample_alg=alg), axis=0, out=rgba)
+        elif n_bands >= 3:
+            # 各バンドをRGBAバッファの該当チャンネルへ直接読み込む (中間の配列を作らない)
+            for i in range(min(n_bands, 4)):
+                bands[i].ReadAsArray(buf_obj=rgba[:, :, i], resample_alg=alg)
+            if n_bands == 3:
+                rgba[:, :, 3] = 255
+        else:
+            # グレースケール (+アルファ)
+            bands[0].ReadAsArray(buf_obj=rgba[:, :, 0], resample_alg=alg)
+            rgba[:, :, 1] = rgba[:, :, 0]
+            rgba[:, :, 2] = rgba[:, :, 0]
+            if n_bands == 2:
+                bands[1].ReadAsArray(buf_obj=rgba[:, :, 3], resample_alg=alg)
+            else:
+                rgba[:, :, 3] = 255
+        bands = None
+        ds = None
+    finally:
+        gdal.Unlink(path)
+    return decode_rgba_batch(rgba, fmt)
+
+def decode_with_qimage(content, fmt, keep_512=False):
+    """QImageで読み込み、QImageのメモリをコピーせずに参照したままデコードする"""
+    qimg = QImage()
+    qimg.loadFromData(content)
+    if qimg.isNull(): return None
+
+    # 画像のリサイズ (512pxタイルの切り抜きはデコード後に行う)
+    if keep_512 and qimg.width() == 512 and qimg.height() == 512:
+        pass
+    elif qimg.width() != 256 or qimg.height() != 256:
+        qimg = qimg.scaled(256, 256, *QIMAGE_SCALE_ARGS)
+    qimg = qimg.convertToFormat(QIMAGE_RGBA8888)
+
+    width, height, line = qimg.width(), qimg.height(), qimg.bytesPerLine()
+    ptr = qimg.constBits()
+    try:
+        ptr.setsize(height * line)
+    except AttributeError:
+        pass # QGIS 4.0 (PyQt6) では不要なためスキップ
+    rgba = np.frombuffer(ptr, dtype=np.uint8, count=height * line).reshape(height, line // 4, 4)[:, :width]
+    # qimg が生きている間にデコードを終える (結果は新しい配列)
+    return decode_rgba_batch(rgba, fmt)
+
+def decode_image(content, fmt, keep_512=False):
+    """画像のバイト列を標高配列にデコードする (読み込めなければNone)"""
+    backend = IMAGE_BACKEND
+    if backend == "qimage" or (backend == "auto" and gdal is None):
+        return decode_with_qimage(content, fmt, keep_512) if QImage is not None else None
+
+    dem = decode_with_gdal(content, fmt, keep_512)
+    if dem is None and backend == "auto" and QImage is not None:
+        # GDALで読めない画像だけQImageで読み直す
+        dem = decode_with_qimage(content, fmt, keep_512)
+    return dem
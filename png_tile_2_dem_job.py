@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+再開可能なジョブのチェックポイント
+ジョブフォルダに条件 (manifest.json) と完了したタイル・ウィンドウの記録 (progress.log) を残し、
+同じ条件で再実行したときに続きから処理できるようにする。
+"""
+
+import os
+import json
+import time
+
+MANIFEST_VERSION = 1
+MOSAIC_FILE = "mosaic.tif"     # 通常モードの合成モザイク (EPSG:3857)
+CHUNKED_FILE = "chunked.tif"   # 分割モードの出力 (完了後に出力先へコピー)
+
+
+class JobCheckpoint:
+    """manifest.json と追記型の progress.log によるチェックポイント"""
+
+    # 途中経過をファイルに確定させる間隔
+    COMMIT_EVERY = 256
+    COMMIT_SECONDS = 10.0
+
+    def __init__(self, job_dir, params):
+        os.makedirs(job_dir, exist_ok=True)
+        self.job_dir = job_dir
+        self.manifest_path = os.path.join(job_dir, "manifest.json")
+        self.log_path = os.path.join(job_dir, "progress.log")
+        # JSONを往復させた形で比較する (タプルとリストの違いなどを吸収)
+        self.params = json.loads(json.dumps(dict(params, version=MANIFEST_VERSION)))
+        self.resumed = False
+        self.done_tiles = {}    # (bx, by) -> (書き込み有無, 高解像度欠損)
+        self.done_windows = {}  # ウィンドウ番号 -> (書き込みタイル数, 高解像度欠損タイル数)
+        self._pending = []
+        self._last_commit = time.monotonic()
+
+        previous = None
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, encoding="utf-8") as f:
+                    previous = json.load(f).get("params")
+            except (OSError, ValueError):
+                previous = None
+
+        if previous == self.params:
+            self.resumed = True
+            self._load_log()
+        else:
+            # 条件が違う (または初回) なら前回の成果物を捨てて作り直す (このクラスが作るファイルのみ削除)
+            for name in ("manifest.json", "progress.log", MOSAIC_FILE, CHUNKED_FILE,
+                         MOSAIC_FILE + ".aux.xml", CHUNKED_FILE + ".aux.xml"):
+                path = os.path.join(job_dir, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+            with open(self.manifest_path, "w", encoding="utf-8") as f:
+                json.dump({"params": self.params, "created": time.time()}, f, ensure_ascii=False, indent=1)
+
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    def _load_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                # 書きかけの行 (クラッシュ時) は無視する
+                try:
+                    if len(parts) == 5 and parts[0] == "T":
+                        self.done_tiles[(int(parts[1]), int(parts[2]))] = (parts[3] == "1", parts[4] == "1")
+                    elif len(parts) == 4 and parts[0] == "W":
+                        self.done_windows[int(parts[1])] = (int(parts[2]), int(parts[3]))
+                except ValueError:
+                    continue
+
+    def discard_progress(self):
+        """対応するラスタが失われていた場合などに、完了記録だけを捨てて最初からやり直す"""
+        self.done_tiles.clear()
+        self.done_windows.clear()
+        self._pending = []
+        self.resumed = False
+        self._log.truncate(0)
+
+    def path(self, name):
+        return os.path.join(self.job_dir, name)
+
+    def add_tile(self, bx, by, written, high_res_missing):
+        self.done_tiles[(bx, by)] = (written, high_res_missing)
+        self._pending.append(f"T {bx} {by} {int(written)} {int(high_res_missing)}\n")
+
+    def add_window(self, index, written, missing_highres):
+        self.done_windows[index] = (written, missing_highres)
+        self._pending.append(f"W {index} {written} {missing_highres}\n")
+
+    def should_commit(self):
+        return len(self._pending) >= self.COMMIT_EVERY or time.monotonic() - self._last_commit >= self.COMMIT_SECONDS
+
+    def commit(self):
+        """
+        記録をファイルに確定させる。
+        呼び出し側は、対応するラスタの書き込みを先にディスクへ反映 (FlushCache) しておくこと。
+        """
+        if self._pending:
+            self._log.writelines(self._pending)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._pending = []
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._log.close()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+通信まわりの共通処理
+全スレッドで1つのSessionを共有し、ホストごとに持続的なHTTP接続を使い回す。
+リクエスト間隔はホストごとのトークンバケットで制御し、429/5xxを受けたら自動で減速する。
+"""
+
+import time
+import random
+import email.utils
+from threading import Lock, Condition
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .png_tile_2_dem_stats import run_stats
+
+USER_AGENT = "QGIS-PngTile2Dem-Integrated"
+
+# TILE_SOURCES で指定がない場合のホストごとの既定値
+DEFAULT_RATE_LIMIT = 20.0      # 最大リクエスト数/秒
+DEFAULT_MAX_CONCURRENCY = 16   # 同時接続数の上限
+DEFAULT_MAX_RETRIES = 1
+
+_session = None
+_session_lock = Lock()
+_limiters = {}
+_limiters_lock = Lock()
+_rate_share = 1.0   # 複数プロセスで取得する場合の、このプロセスの取り分
+
+
+def _create_session(max_connections_per_host):
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    # pool_connections: プールを保持するホスト数 / pool_maxsize: ホストごとの同時接続数
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_connections_per_host, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def open_session(max_connections_per_host=32):
+    """共有Sessionを作り直す。ワーカー数に合わせてホストごとの接続プールを確保する"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = _create_session(max_connections_per_host)
+    reset_limiters()
+    return _session
+
+
+def get_session():
+    """共有Sessionを返す (未作成なら既定の設定で作る)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session(32)
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# ==============================================================================
+# ホスト単位のレート制御
+# ==============================================================================
+
+class HostLimiter:
+    """トークンバケットによる流量制御と、AIMDによる同時接続数の適応制御を行う"""
+
+    MIN_RATE = 0.5
+    RECOVER_AFTER = 20   # この回数だけ連続で成功したら1段階ずつ元の速度に戻す
+
+    def __init__(self, rate_limit, max_concurrency):
+        self.max_rate = float(rate_limit)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.rate = self.max_rate
+        self.concurrency = self.max_concurrency
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.successes = 0
+        self.cond = Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.in_flight >= self.concurrency:
+                    wait = None  # release() からの通知を待つ
+                elif self.tokens < 1.0:
+                    wait = (1.0 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1.0
+                    self.in_flight += 1
+                    return
+                self.cond.wait(wait)
+
+    def release(self, throttled=False, retry_after=None):
+        """throttled: 429/5xx/通信エラーで失敗した場合にTrue"""
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                # 乗算的に減速し、Retry-After (なければ指数バックオフ) の間このホストへの送信を止める
+                self.failures += 1
+                self.successes = 0
+                self.rate = max(self.MIN_RATE, self.rate / 2.0)
+                self.concurrency = max(1, self.concurrency // 2)
+                if retry_after is None:
+                    retry_after = min(30.0, 2.0 ** self.failures) * random.uniform(0.5, 1.0)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            else:
+                # 加算的に回復する
+                self.failures = 0
+                self.successes += 1
+                if self.successes >= self.RECOVER_AFTER:
+                    self.successes = 0
+                    self.rate = min(self.max_rate, self.rate * 1.25)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.cond.notify_all()
+
+
+def get_limiter(url, source):
+    """URLのホストに対応するLimiterを返す (設定は最初にそのホストを使ったソースのものを採用)"""
+    host = urlsplit(url).netloc
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(
+                source.get("rate_limit", DEFAULT_RATE_LIMIT) * _rate_share,
+                max(1, round(source.get("max_concurrency", DEFAULT_MAX_CONCURRENCY) * _rate_share))
+            )
+            _limiters[host] = limiter
+        return limiter
+
+
+def reset_limiters():
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def set_rate_share(share):
+    """
+    ホストごとの上限のうち、このプロセスが使う割合を設定する (既定1.0)。
+    複数のプロセスから同じホストに取得しても、合計が上限を超えないようにするため。
+    """
+    global _rate_share
+    _rate_share = float(share)
+    reset_limiters()
+
+
+def parse_retry_after(value):
+    """Retry-Afterヘッダ (秒数またはHTTP日付) を秒数に変換する"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_tile_bytes(url, source):
+    """
+    タイルを取得して (ステータスコード, バイト列) を返す。
+    再試行しても429/5xx・通信エラーが続いた場合のステータスはNone。
+    """
+    session = get_session()
+    limiter = get_limiter(url, source)
+    max_retries = source.get("max_retries", DEFAULT_MAX_RETRIES)
+    host = urlsplit(url).netloc
+
+    for attempt in range(max_retries):
+        if attempt > 0:
+            run_stats.add_retry(source["key"])
+        t0 = time.perf_counter()
+        limiter.acquire()
+        t1 = time.perf_counter()
+        run_stats.add_time("rate_limit_wait", t1 - t0)
+        try:
+            r = session.get(url, timeout=15)
+        except Exception:
+            run_stats.add_time("download", time.perf_counter() - t1)
+            run_stats.add_request(host, source["key"], None, 0)
+            limiter.release(throttled=True)
+            continue
+        run_stats.add_time("download", time.perf_counter() - t1)
+        run_stats.add_request(host, source["key"], r.status_code, len(r.content))
+
+        if r.status_code == 429 or r.status_code >= 500:
+            limiter.release(throttled=True, retry_after=parse_retry_after(r.headers.get("Retry-After")))
+            continue
+
+        limiter.release()
+        if r.status_code != 200:
+            return r.status_code, None
+        return r.status_code, r.content
+    return None, None
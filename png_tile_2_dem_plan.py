@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+処理時間の見積もり
+主ソース・Q地図・補完用ソースごとに実際に出すリクエスト数 (高ズームのサブタイル、512pxタイル、
+低ズームの親タイル、カバレッジ判定用タイルを含む) を数え、タイルキャッシュにあるものを差し引く。
+時間は過去の実行で記録したホストごとの処理量 (リクエスト/秒) と、1タイルあたりのローカル処理時間から求める。
+"""
+
+import os
+import json
+import math
+import time
+from urllib.parse import urlsplit
+
+from .png_tile_2_dem_sources import TILE_SOURCES, FALLBACK_KEYS, COVERAGE_ZOOM_OFFSET, tile_request
+from .png_tile_2_dem_cache import DiskTileCache, DEFAULT_CACHE_DIR
+
+HISTORY_FILE = "throughput.json"
+HISTORY_VERSION = 1
+HISTORY_WEIGHT = 0.3          # 新しい実行の計測値を混ぜる割合 (指数移動平均)
+MIN_HOST_REQUESTS = 20        # これより少ないリクエスト数のホストは処理量を記録しない
+CACHE_CHECK_MAX = 2000        # キャッシュの有無を調べるタイル数の上限 (超える分は間引いて推定する)
+
+# 記録がない場合の既定値
+DEFAULT_RATE_LIMIT = 20.0     # png_tile_2_dem_net の既定値と同じ
+DEFAULT_LOCAL_SEC_PER_TILE = 0.02
+DEFAULT_FETCH_RATIO = 0.25    # 主ソース以外 (Q地図・補完用) は穴のあるタイルでしか取得しない
+
+# ローカル処理 (通信以外) として数える段階
+LOCAL_STAGES = ("decode", "resample", "composite", "tile_write", "mosaic", "warp", "finalize")
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    lat_rad = math.radians(lat)
+    n = 2.0 ** zoom
+    xtile = int((lon + 180.0) / 360.0 * n)
+    ytile = int((1.0 - math.log(math.tan(lat_rad) + (1.0 / math.cos(lat_rad))) / math.pi) / 2.0 * n)
+    return xtile, ytile
+
+
+def tile_range_for_lonlat(lonlat_bounds, z):
+    """経緯度範囲に掛かるタイル範囲 (tx_start, ty_start, tx_end, ty_end)"""
+    lon0, lat0, lon1, lat1 = lonlat_bounds
+    tx0, ty_max = lonlat_to_tile(lon0, lat1, z)
+    tx1, ty_min = lonlat_to_tile(lon1, lat0, z)
+    return min(tx0, tx1), min(ty_min, ty_max), max(tx0, tx1), max(ty_min, ty_max)
+
+
+def format_duration(seconds, sep=" "):
+    """見積もり時間の表示 (例: "3 分 20 秒")"""
+    if seconds < 60:
+        return f"{int(seconds)}{sep}秒"
+    return f"{int(seconds // 60)}{sep}分{sep}{int(seconds % 60)}{sep}秒"
+
+
+def source_host(source):
+    return urlsplit(source["url"]).netloc
+
+
+def request_rect(source, tile_rect, base_z):
+    """
+    ズーム base_z のタイル範囲を合成するためにソースへ要求するタイル範囲 (z, x0, y0, x1, y1)。
+    高ズームのソースはサブタイル、低ズームのソースは親タイル、512pxのソースは1つ上のズームのタイルになる。
+    """
+    tx0, ty0, tx1, ty1 = tile_rect
+    src_z = source["zoom"]
+    if src_z >= base_z:
+        shift = src_z - base_z
+        x0, y0, x1, y1 = tx0 << shift, ty0 << shift, ((tx1 + 1) << shift) - 1, ((ty1 + 1) << shift) - 1
+    else:
+        shift = base_z - src_z
+        x0, y0, x1, y1 = tx0 >> shift, ty0 >> shift, tx1 >> shift, ty1 >> shift
+    req_z, rx0, ry0, _ = tile_request(source, x0, y0, src_z)
+    _, rx1, ry1, _ = tile_request(source, x1, y1, src_z)
+    return req_z, rx0, ry0, rx1, ry1
+
+
+def coverage_rect(source, tile_rect, base_z):
+    """カバレッジ判定に使う低ズームタイルの範囲 (判定しないソースはNone)"""
+    if source["key"].startswith("fallback_"):
+        return None
+    cz = source.get("coverage_zoom", source["zoom"] - COVERAGE_ZOOM_OFFSET)
+    if cz < 0 or base_z <= cz:
+        return None
+    shift = base_z - cz
+    tx0, ty0, tx1, ty1 = tile_rect
+    req_z, rx0, ry0, _ = tile_request(source, tx0 >> shift, ty0 >> shift, cz)
+    _, rx1, ry1, _ = tile_request(source, tx1 >> shift, ty1 >> shift, cz)
+    return req_z, rx0, ry0, rx1, ry1
+
+
+def rect_count(rect):
+    _, x0, y0, x1, y1 = rect
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+def count_cached(disk_cache, source_key, rect):
+    """範囲内でキャッシュ (欠損の記録を含む) にあるタイル数。多い場合は等間隔に間引いて調べ、割合から推定する"""
+    z, x0, y0, x1, y1 = rect
+    width = x1 - x0 + 1
+    total = rect_count(rect)
+    step = max(1, -(-total // CACHE_CHECK_MAX))
+    checked = hits = 0
+    for i in range(0, total, step):
+        checked += 1
+        if disk_cache.contains(source_key, z, x0 + i % width, y0 + i // width):
+            hits += 1
+    if checked == 0:
+        return 0
+    return int(round(hits * total / checked))
+
+
+def plan_requests(tile_rect, base_z, primary_key, sources=TILE_SOURCES, disk_cache=None):
+    """
+    ソースごとの予定リクエスト数を返す: {ソースキー: {"host", "requests", "cached"}}。
+    requests は穴埋めが全タイルで起きた場合の上限 (カバレッジ判定用タイルを含む)。
+    disk_cache を渡すと、そのうちキャッシュにある数を cached に入れる。
+    """
+    keys = [primary_key] + (["qmap"] if primary_key != "qmap" else []) + FALLBACK_KEYS
+    plan = {}
+    for key in keys:
+        source = next((s for s in sources if s["key"] == key), None)
+        if source is None:
+            continue
+        rects = [r for r in (request_rect(source, tile_rect, base_z), coverage_rect(source, tile_rect, base_z)) if r]
+        entry = {"host": source_host(source), "requests": sum(rect_count(r) for r in rects), "cached": 0}
+        if disk_cache is not None:
+            entry["cached"] = sum(count_cached(disk_cache, key, r) for r in rects)
+        plan[key] = entry
+    return plan
+
+
+# ==============================================================================
+# 過去の実行の計測値
+# ==============================================================================
+
+def history_path(cache_dir):
+    return os.path.join(cache_dir, HISTORY_FILE)
+
+
+def load_history(cache_dir):
+    """記録済みの処理量 (なければ空の記録)"""
+    try:
+        with open(history_path(cache_dir), encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == HISTORY_VERSION:
+            return data
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"version": HISTORY_VERSION, "hosts": {}, "fetch_ratio": {}, "local_sec_per_tile": None}
+
+
+def blend(old, new):
+    return new if old is None else old * (1.0 - HISTORY_WEIGHT) + new * HISTORY_WEIGHT
+
+
+def record_run(cache_dir, snapshot, plan, tiles):
+    """
+    実行の計測値 (RunStats.snapshot()) から、ホストごとのリクエスト/秒、ソースごとの
+    予定に対する実際のリクエストの割合、1タイルあたりのローカル処理時間を記録に混ぜる。
+    plan と tiles は範囲全体のものなので、最後まで処理した実行についてだけ呼ぶこと。
+    """
+    if tiles <= 0:
+        return
+    history = load_history(cache_dir)
+    for host, h in snapshot["hosts"].items():
+        span = (h.get("last") or 0) - (h.get("first") or 0)
+        if h["requests"] >= MIN_HOST_REQUESTS and span > 0:
+            rps = h["requests"] / span
+            history["hosts"][host] = {"rps": blend(history["hosts"].get(host, {}).get("rps"), rps),
+                                      "updated": time.time()}
+    for key, entry in plan.items():
+        planned = entry["requests"] - entry["cached"]
+        if planned <= 0:
+            continue
+        s = snapshot["sources"].get(key, {})
+        actual = s.get("requests", 0) - s.get("retries", 0)
+        history["fetch_ratio"][key] = blend(history["fetch_ratio"].get(key), min(1.0, actual / planned))
+    local = sum(snapshot["stage_seconds"].get(stage, 0.0) for stage in LOCAL_STAGES)
+    history["local_sec_per_tile"] = blend(history["local_sec_per_tile"], local / tiles)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = history_path(cache_dir) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, history_path(cache_dir))
+    except OSError:
+        pass
+
+
+def estimate_seconds(plan, primary_key, tiles, history, sources=TILE_SOURCES):
+    """
+    見積もり時間 (秒)。ホスト同士は並行して取得するので、最も時間のかかるホストの時間に
+    ローカル処理の時間を足す。記録のないホストは設定上のレート上限で取得できるものとする。
+    """
+    per_host = {}
+    for key, entry in plan.items():
+        ratio = history["fetch_ratio"].get(key, 1.0 if key == primary_key else DEFAULT_FETCH_RATIO)
+        per_host[entry["host"]] = per_host.get(entry["host"], 0.0) + (entry["requests"] - entry["cached"]) * ratio
+
+    network = 0.0
+    for host, requests in per_host.items():
+        rps = history["hosts"].get(host, {}).get("rps")
+        if not rps:
+            rps = min((s.get("rate_limit", DEFAULT_RATE_LIMIT) for s in sources if source_host(s) == host),
+                      default=DEFAULT_RATE_LIMIT)
+        network = max(network, requests / rps)
+
+    local = history["local_sec_per_tile"]
+    return network + tiles * (DEFAULT_LOCAL_SEC_PER_TILE if local is None else local)
+
+
+def summarize(plan):
+    """(予定リクエスト数の合計, うちキャッシュ済みの数)"""
+    return sum(e["requests"] for e in plan.values()), sum(e["cached"] for e in plan.values())
+
+
+def estimate_job(tile_rect, base_z, primary_key, sources=TILE_SOURCES, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+    """
+    実行前の見積もり (ダイアログ用): (予定リクエスト数, うちキャッシュ済みの数, 見積もり時間 (秒)) を返す。
+    キャッシュがまだ作られていなければ、新たに作らずにキャッシュなしとして数える。
+    """
+    disk_cache = None
+    if use_cache and os.path.exists(os.path.join(cache_dir, "tiles.sqlite")):
+        try:
+            disk_cache = DiskTileCache(cache_dir, 0)
+        except Exception:
+            disk_cache = None
+    try:
+        plan = plan_requests(tile_rect, base_z, primary_key, sources, disk_cache)
+    finally:
+        if disk_cache is not None:
+            disk_cache.close()
+    tx0, ty0, tx1, ty1 = tile_rect
+    tiles = (tx1 - tx0 + 1) * (ty1 - ty0 + 1)
+    seconds = estimate_seconds(plan, primary_key, tiles, load_history(cache_dir), sources)
+    return summarize(plan) + (seconds,)
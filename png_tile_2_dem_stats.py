@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+処理の計測 (段階ごとの時間と件数)
+取得・レート制御の待ち・デコード・リサイズ・合成・書き込み・Warp の時間と、
+ホスト・ソースごとの通信量やリトライ回数を集計し、ログとJSONのレポートにまとめる。
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+REPORT_VERSION = 1
+
+# 段階の表示順と表示名
+STAGES = [
+    ("download", "取得"),
+    ("rate_limit_wait", "レート制御の待ち"),
+    ("decode", "デコード"),
+    ("resample", "リサイズ"),
+    ("composite", "合成"),
+    ("tile_write", "タイルの書き込み"),
+    ("mosaic", "ウィンドウのモザイク"),
+    ("warp", "Warp"),
+    ("finalize", "出力の変換 (COG・整数化)"),
+]
+
+
+class RunStats:
+    """1回の実行の計測値 (スレッドセーフ)。時間はスレッドごとの合計 (並列なら実時間より長くなる)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stage_seconds = defaultdict(float)
+            self.stage_calls = defaultdict(int)
+            # first / last: そのホストへの最初と最後のリクエストの時刻 (処理量の計算に使う)
+            self.hosts = defaultdict(lambda: {"requests": 0, "bytes": 0, "first": None, "last": None})
+            self.sources = defaultdict(lambda: {"requests": 0, "bytes": 0, "retries": 0, "throttled": 0,
+                                                "errors": 0, "not_found": 0})
+            self.filled_by = defaultdict(int)  # ソースキー -> そのソースで画素を埋めたタイル数
+            self.counters = defaultdict(int)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += calls
+
+    @contextmanager
+    def timer(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def add_request(self, host, source_key, status, nbytes):
+        """HTTPリクエスト1回分 (status: ステータスコード、通信エラーはNone)"""
+        now = time.time()
+        with self._lock:
+            h = self.hosts[host]
+            h["requests"] += 1
+            h["bytes"] += nbytes
+            if h["first"] is None:
+                h["first"] = now
+            h["last"] = now
+            s = self.sources[source_key]
+            s["requests"] += 1
+            s["bytes"] += nbytes
+            if status is None:
+                s["errors"] += 1
+            elif status == 429 or status >= 500:
+                s["throttled"] += 1
+            elif status in (204, 404, 410):
+                s["not_found"] += 1
+
+    def add_retry(self, source_key):
+        with self._lock:
+            self.sources[source_key]["retries"] += 1
+
+    def add_fill(self, source_key):
+        with self._lock:
+            self.filled_by[source_key] += 1
+
+    def snapshot(self):
+        """集計値を辞書で返す (ワーカープロセスから親へ渡す形と同じ)"""
+        with self._lock:
+            return {
+                "stage_seconds": dict(self.stage_seconds),
+                "stage_calls": dict(self.stage_calls),
+                "hosts": {k: dict(v) for k, v in self.hosts.items()},
+                "sources": {k: dict(v) for k, v in self.sources.items()},
+                "filled_by": dict(self.filled_by),
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, snap):
+        """別プロセスの snapshot() を加算する"""
+        with self._lock:
+            for k, v in snap["stage_seconds"].items(): self.stage_seconds[k] += v
+            for k, v in snap["stage_calls"].items(): self.stage_calls[k] += v
+            for k, v in snap["hosts"].items():
+                h = self.hosts[k]
+                h["requests"] += v["requests"]
+                h["bytes"] += v["bytes"]
+                if v["first"] is not None:
+                    h["first"] = v["first"] if h["first"] is None else min(h["first"], v["first"])
+                    h["last"] = v["last"] if h["last"] is None else max(h["last"], v["last"])
+            for k, v in snap["sources"].items():
+                for f, n in v.items(): self.sources[k][f] += n
+            for k, v in snap["filled_by"].items(): self.filled_by[k] += v
+            for k, v in snap["counters"].items(): self.counters[k] += v
+
+    def report(self, **extra):
+        """JSONレポートの内容"""
+        data = self.snapshot()
+        data.update(version=REPORT_VERSION, started=self.started, elapsed=time.time() - self.started)
+        data.update(extra)
+        return data
+
+    def write_json(self, path, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=1)
+
+    def summary_lines(self):
+        """ログに出す要約"""
+        snap = self.snapshot()
+        lines = [f"--- 計測 (経過 {time.time() - self.started:.1f} 秒 / 時間は全スレッドの合計) ---"]
+        for stage, label in STAGES:
+            calls = snap["stage_calls"].get(stage, 0)
+            if calls:
+                lines.append(f"{label}: {snap['stage_seconds'][stage]:.1f} 秒 ({calls} 回)")
+        for host, h in sorted(snap["hosts"].items()):
+            lines.append(f"{host}: {h['requests']} リクエスト / {h['bytes'] / 1e6:.1f} MB")
+        for key, s in sorted(snap["sources"].items()):
+            if s["retries"] or s["throttled"] or s["errors"]:
+                lines.append(f"{key}: リトライ {s['retries']} 回 / 429・5xx {s['throttled']} 回 / 通信エラー {s['errors']} 回")
+        if snap["filled_by"]:
+            filled = ", ".join(f"{k} {v}" for k, v in snap["filled_by"].items())
+            lines.append(f"データを埋めたソース (タイル数): {filled}")
+        return lines
+
+
+# 実行中の計測値 (run_job の開始時にリセットする)
+run_stats = RunStats()
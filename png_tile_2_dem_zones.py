@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+平面直角座標系 (JGD2011, EPSG:6669〜6687) の系番号をオフラインで求める
+経緯度の矩形と系番号の表を上から順に調べ、最初に含まれた矩形の系を返す (通信は行わない)。
+矩形は都道府県の範囲をおおまかに近似したもので、県境付近では隣の系になることがある。
+ダイアログの「Output CRS」の初期値に使うだけなので、利用者が変更できる前提の精度としている。
+"""
+
+# (系番号, 最小経度, 最小緯度, 最大経度, 最大緯度) の順。先に一致したものを使うので、並び順に意味がある
+ZONE_BOXES = [
+    # --- 鹿児島県のうち北緯27〜32度・東経128度18分〜130度13分 (奄美群島・トカラ列島・甑島など) は1系 ---
+    (1, 128.3, 27.0, 130.21666666666667, 32.0),
+    # --- 沖縄県 (東経126度から西は16系、東経130度から東は17系、その間は15系) ---
+    (16, 122.5, 23.9, 126.0, 27.2),
+    (15, 126.0, 23.9, 130.0, 27.2),
+    (17, 130.0, 23.9, 131.5, 27.2),
+    # --- 東京都の北緯28度から南の島 (東経140度30分から西は18系、東経143度から東は19系、その間は14系) ---
+    (18, 135.5, 20.0, 140.5, 28.0),
+    (14, 140.5, 20.0, 143.0, 28.0),
+    (19, 143.0, 20.0, 154.5, 28.0),
+    # --- 長崎県 (1系) ---
+    (1, 129.0, 33.65, 129.9, 34.8),    # 対馬・壱岐
+    (1, 128.5, 32.5, 129.85, 33.6),    # 五島・平戸・佐世保
+    (1, 129.7, 32.55, 130.2, 33.05),   # 長崎・諫早・大村
+    (1, 130.2, 32.55, 130.4, 32.95),   # 島原半島
+    # --- 九州のその他の県 (2系。北端は関門海峡の南岸までとし、下関を含めない) ---
+    (2, 129.6, 30.9, 131.05, 33.935),
+    (2, 130.955, 33.85, 131.05, 33.97),  # 門司
+    (2, 131.05, 30.9, 132.1, 33.25),
+    (2, 131.05, 33.25, 131.95, 33.75),
+    (2, 128.9, 28.6, 131.3, 30.9),     # 種子島・屋久島・トカラ列島
+    # --- 四国 (4系) ---
+    (4, 132.0, 32.7, 133.3, 33.6),
+    (4, 132.45, 33.6, 133.3, 34.1),
+    (4, 133.3, 32.7, 133.9, 34.42),
+    (4, 133.9, 32.7, 134.45, 34.42),   # 北端は高松の沖までとし、対岸の玉野を含めない
+    (4, 133.96, 34.43, 134.02, 34.47), # 直島
+    (4, 134.1, 34.42, 134.45, 34.58),  # 小豆島 (北の牛窓を含めない)
+    (4, 134.45, 32.7, 134.85, 34.25),
+    # --- 山口県・島根県・広島県 (3系) ---
+    (3, 130.75, 33.75, 133.4, 35.0),
+    (3, 131.6, 35.0, 133.2, 35.7),
+    (3, 133.2, 35.2, 133.29, 35.47),   # 安来 (東は米子)
+    (3, 133.2, 35.555, 133.35, 35.65), # 美保関 (南の境港を含めない)
+    (3, 132.5, 35.85, 133.5, 36.4),    # 隠岐
+    # --- 兵庫県・鳥取県・岡山県 (5系) ---
+    (5, 133.4, 34.15, 135.05, 34.5),
+    (5, 133.4, 34.5, 135.42, 35.1),
+    (5, 133.2, 35.1, 135.1, 35.45),
+    (5, 135.1, 35.1, 135.45, 35.2),
+    (5, 133.2, 35.45, 134.9, 35.7),
+    # --- 京都府・大阪府・福井県・滋賀県・三重県・奈良県・和歌山県 (6系) ---
+    (6, 134.9, 33.4, 137.0, 34.55),
+    (6, 134.9, 34.55, 136.45, 35.35),
+    (6, 136.45, 34.55, 136.715, 35.15),  # 三重県北部 (木曽川まで)
+    (6, 134.9, 35.35, 136.45, 35.75),
+    (6, 135.4, 35.75, 136.55, 36.2),
+    (6, 136.1, 36.2, 136.3, 36.28),    # あわら (北は加賀)
+    # --- 石川県・富山県・岐阜県・愛知県 (7系) ---
+    (7, 136.2, 34.55, 137.48, 35.3),
+    (7, 136.2, 35.3, 137.6, 36.5),
+    (7, 136.2, 36.5, 137.68, 37.9),
+    # --- 新潟県・長野県・山梨県・静岡県 (8系) ---
+    (9, 138.98, 35.68, 139.9, 35.9),     # 東京都の多摩西部 (山梨県より先に調べる)
+    (9, 139.09, 35.13, 139.2, 35.2),     # 湯河原 (静岡県より先に調べる。南は熱海)
+    (8, 137.48, 34.55, 139.17, 35.15),
+    (8, 137.55, 35.15, 139.0, 35.5),
+    (8, 137.6, 35.5, 139.15, 35.9),
+    (8, 137.6, 35.9, 138.7, 36.85),
+    (8, 137.68, 36.85, 139.1, 37.3),
+    (8, 137.68, 37.3, 139.22, 37.55),    # 魚沼・三条 (東は福島県の只見)
+    (8, 137.68, 37.55, 139.5, 38.0),
+    (8, 137.8, 38.0, 139.6, 38.6),     # 佐渡・村上
+    # --- 関東・福島県・伊豆諸島 (9系) ---
+    (9, 138.4, 34.9, 141.1, 37.75),
+    (9, 140.3, 37.75, 140.65, 37.98),  # 伊達・国見 (北は白石)
+    (9, 140.65, 37.75, 141.1, 37.88),  # 相馬・新地 (北は丸森)
+    (9, 138.9, 29.5, 140.4, 34.9),
+    # --- 東北 (福島県を除く) (10系) ---
+    (10, 139.3, 37.7, 142.2, 41.38),
+    (10, 140.6, 41.38, 142.2, 41.6),   # 下北半島
+    # --- 北海道 (振興局の範囲で11〜13系に分かれる) ---
+    (12, 140.9, 42.25, 141.05, 42.42), # 室蘭市
+    (11, 139.3, 41.35, 141.2, 42.0),   # 渡島
+    (11, 139.3, 42.0, 141.05, 43.35),  # 後志・檜山・小樽・伊達
+    (13, 143.0, 42.3, 149.0, 45.6),    # 十勝・釧路・根室・オホーツク
+    (13, 142.75, 42.8, 143.0, 43.3),   # 十勝の西部 (日高山脈の東。西の占冠・トマムを含めない)
+    (13, 143.22, 42.17, 143.6, 42.3),  # 広尾 (南西はえりも)
+    (13, 142.75, 44.2, 143.0, 44.6),   # オホーツクの西部
+    (12, 139.3, 41.35, 149.0, 45.6),
+]
+
+EPSG_ZONE_OFFSET = 6668  # 系番号 + 6668 = EPSGコード (1系 = EPSG:6669)
+
+
+def plane_rectangular_zone(lon, lat):
+    """経緯度を含む平面直角座標系の系番号 (1〜19)。国内の範囲外ならNone"""
+    for zone, minx, miny, maxx, maxy in ZONE_BOXES:
+        if minx <= lon <= maxx and miny <= lat <= maxy:
+            return zone
+    return None
+
+
+def default_crs_for(lon, lat, fallback="EPSG:4326"):
+    """経緯度に合う平面直角座標系の "EPSG:xxxx" (範囲外なら fallback)"""
+    zone = plane_rectangular_zone(lon, lat)
+    if zone is None:
+        return fallback
+    return f"EPSG:{EPSG_ZONE_OFFSET + zone}"